@@ -11,6 +11,12 @@ class Config:
     admin_ids: List[int]
     bot_token: str
     database_path: str
+    db_readers: int
+    db_group_commit_window: float
+    settings_poll_seconds: int
+    user_cache_size: int
+    user_cache_ttl: int
+    backup_compression: str
     img_url_main: str
     img_url_stars: str
     img_url_premium: str
@@ -19,20 +25,40 @@ class Config:
     welcome_description: str
     api_ton: str
     wallet_seed: str 
+    wallet_seeds: List[str]
     fragment_cookies: Dict[str, str]
     fragment_hash: str
     fragment_public_key: str
     fragment_wallets: str
     fragment_address: str
+    fragment_http2: bool
+    fragment_pool_size: int
+    fragment_pool_keepalive: int
+    fragment_keepalive_expiry: float
+    fulfillment_workers: int
+    ton_batch_window: float
+    ton_batch_max_messages: int
+    ton_confirm_timeout: float
+    ton_balance_sync_seconds: int
+    recipient_cache_size: int
+    recipient_cache_ttl: float
+    recipient_negative_ttl: float
+    prefetch_ttl: float
+    fragment_target_latency: float
+    fragment_breaker_threshold: int
+    fragment_breaker_reset: float
     cryptopay_token: str
     lzt_token: str
     lzt_user_id: str
     crystalpay_login: str
     crystalpay_secret_key: str
     crystalpay_api_url: str
+    crystalpay_salt: str
+    crystalpay_callback_url: str
     ton_wallet_address: str
     min_payment_amount: int
     payment_timeout_seconds: int
+    crystalpay_check_concurrency: int
 
 def load_config(path: str = ".env"):
     dotenv_path = find_dotenv(path, usecwd=True)
@@ -65,6 +91,13 @@ def load_config(path: str = ".env"):
     mnemonic_str = os.getenv("MNEMONIC", "")
     wallet_seed_str = ' '.join([word.strip() for word in mnemonic_str.split(',') if word.strip()])
 
+    wallet_seeds_list = [wallet_seed_str] if wallet_seed_str else []
+    seed_index = 2
+    while os.getenv(f"MNEMONIC_{seed_index}"):
+        extra_mnemonic = os.getenv(f"MNEMONIC_{seed_index}")
+        wallet_seeds_list.append(' '.join([word.strip() for word in extra_mnemonic.split(',') if word.strip()]))
+        seed_index += 1
+
     fragment_cookies_dict = {
         'stel_ssid': os.getenv("STEL_SSID"),
         'stel_dt': os.getenv("STEL_DT"),
@@ -76,6 +109,12 @@ def load_config(path: str = ".env"):
         admin_ids=admin_ids_list,
         bot_token=bot_token_raw,
         database_path=os.getenv("DATABASE_PATH", "database.db"),
+        db_readers=int(os.getenv("DB_READERS", 4)),
+        db_group_commit_window=int(os.getenv("DB_GROUP_COMMIT_MS", 5)) / 1000,
+        settings_poll_seconds=int(os.getenv("SETTINGS_POLL_SECONDS", 0)),
+        user_cache_size=int(os.getenv("USER_CACHE_SIZE", 10000)),
+        user_cache_ttl=int(os.getenv("USER_CACHE_TTL", 300)),
+        backup_compression=os.getenv("BACKUP_COMPRESSION", "zstd").lower(),
         img_url_main=os.getenv("IMG_URL_MAIN"),
         img_url_stars=os.getenv("IMG_URL_STARS"),
         img_url_premium=os.getenv("IMG_URL_PREMIUM"),
@@ -84,19 +123,39 @@ def load_config(path: str = ".env"):
         welcome_description=os.getenv("WELCOME_DESCRIPTION", "").replace("\\n", "\n"),
         api_ton=os.getenv("API_TON"),
         wallet_seed=wallet_seed_str, 
+        wallet_seeds=wallet_seeds_list,
         fragment_cookies=fragment_cookies_dict,
         fragment_hash=os.getenv("FRAGMENT_HASH"),
         fragment_public_key=os.getenv("FRAGMENT_PUBLICKEY"),
         fragment_wallets=os.getenv("FRAGMENT_WALLETS"),
         fragment_address=os.getenv("FRAGMENT_ADDRES"),
+        fragment_http2=os.getenv("FRAGMENT_HTTP2", "1") == "1",
+        fragment_pool_size=int(os.getenv("FRAGMENT_POOL_SIZE", 10)),
+        fragment_pool_keepalive=int(os.getenv("FRAGMENT_POOL_KEEPALIVE", 5)),
+        fragment_keepalive_expiry=float(os.getenv("FRAGMENT_KEEPALIVE_EXPIRY", 60)),
+        fulfillment_workers=int(os.getenv("FULFILLMENT_WORKERS", 4)),
+        ton_batch_window=int(os.getenv("TON_BATCH_WINDOW_MS", 300)) / 1000,
+        ton_batch_max_messages=int(os.getenv("TON_BATCH_MAX_MESSAGES", 4)),
+        ton_confirm_timeout=float(os.getenv("TON_CONFIRM_TIMEOUT", 60)),
+        ton_balance_sync_seconds=int(os.getenv("TON_BALANCE_SYNC_SECONDS", 60)),
+        recipient_cache_size=int(os.getenv("RECIPIENT_CACHE_SIZE", 1000)),
+        recipient_cache_ttl=float(os.getenv("RECIPIENT_CACHE_TTL", 600)),
+        recipient_negative_ttl=float(os.getenv("RECIPIENT_NEGATIVE_TTL", 60)),
+        prefetch_ttl=float(os.getenv("FRAGMENT_PREFETCH_TTL", 120)),
+        fragment_target_latency=float(os.getenv("FRAGMENT_TARGET_LATENCY", 3)),
+        fragment_breaker_threshold=int(os.getenv("FRAGMENT_BREAKER_THRESHOLD", 5)),
+        fragment_breaker_reset=float(os.getenv("FRAGMENT_BREAKER_RESET", 60)),
         cryptopay_token=os.getenv("CRYPTOPAY_TOKEN"),
         lzt_token=os.getenv("LZT_TOKEN"),
         lzt_user_id=os.getenv("LZT_USER_ID"),
         crystalpay_login=os.getenv("CRYSTALPAY_LOGIN"),
         crystalpay_secret_key=os.getenv("CRYSTALPAY_SECRET_KEY"),
         crystalpay_api_url=os.getenv("CRYSTALPAY_API_URL"),
+        crystalpay_salt=os.getenv("CRYSTALPAY_SALT"),
+        crystalpay_callback_url=os.getenv("CRYSTALPAY_CALLBACK_URL"),
         ton_wallet_address=os.getenv("TON_WALLET_ADDRESS"),
         min_payment_amount=int(os.getenv("MIN_PAYMENT_AMOUNT", 10)),
-        payment_timeout_seconds=int(os.getenv("PAYMENT_TIMEOUT_SECONDS", 900))
+        payment_timeout_seconds=int(os.getenv("PAYMENT_TIMEOUT_SECONDS", 900)),
+        crystalpay_check_concurrency=int(os.getenv("CRYSTALPAY_CHECK_CONCURRENCY", 10))
 
     )
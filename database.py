@@ -1,107 +1,267 @@
+import asyncio
 import aiosqlite
 import logging
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional, Tuple
 
-async def init_db(database_path: str):
-    async with aiosqlite.connect(database_path) as db:
-        db.row_factory = aiosqlite.Row
-        
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                telegram_id INTEGER UNIQUE NOT NULL,
-                username TEXT,
-                balance REAL DEFAULT 0,
-                is_admin INTEGER DEFAULT 0,
-                is_blocked INTEGER DEFAULT 0,
-                discount REAL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        current_columns_query = "PRAGMA table_info(payments)"
-        cursor = await db.execute(current_columns_query)
-        columns = [row['name'] for row in await cursor.fetchall()]
-
-        if not columns:
-            await db.execute("""
-                CREATE TABLE payments (
-                    uuid TEXT PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    message_id INTEGER,
-                    amount REAL NOT NULL,
-                    status TEXT NOT NULL DEFAULT 'pending',
-                    invoice_url TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    payment_system TEXT,
-                    external_invoice_id TEXT
-                )
-            """)
-        else:
-            if 'message_id' not in columns:
-                await db.execute("ALTER TABLE payments ADD COLUMN message_id INTEGER")
-            if 'payment_system' not in columns:
-                await db.execute("ALTER TABLE payments ADD COLUMN payment_system TEXT")
-            if 'external_invoice_id' not in columns:
-                await db.execute("ALTER TABLE payments ADD COLUMN external_invoice_id TEXT")
-            if 'status' not in columns:
-                await db.execute("ALTER TABLE payments ADD COLUMN status TEXT NOT NULL DEFAULT 'pending'")
-            if 'is_paid' in columns:
-                try:
-                    await db.execute("UPDATE payments SET status = 'paid' WHERE is_paid = 1 AND status = 'pending'")
-                    
-                except aiosqlite.OperationalError as e:
-                    logging.warning(f"Could not migrate 'is_paid' column data: {e}")
+from services.metrics import metrics
+
+async def _migration_001_baseline(db: aiosqlite.Connection):
+    # Brings both fresh and pre-versioning databases to the original schema.
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE NOT NULL,
+            username TEXT,
+            balance REAL DEFAULT 0,
+            is_admin INTEGER DEFAULT 0,
+            is_blocked INTEGER DEFAULT 0,
+            discount REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    current_columns_query = "PRAGMA table_info(payments)"
+    cursor = await db.execute(current_columns_query)
+    columns = [row['name'] for row in await cursor.fetchall()]
 
+    if not columns:
         await db.execute("""
-            CREATE TABLE IF NOT EXISTS purchase_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+            CREATE TABLE payments (
+                uuid TEXT PRIMARY KEY,
                 user_id INTEGER NOT NULL,
-                purchase_type TEXT NOT NULL,
-                item_description TEXT NOT NULL,
-                amount INTEGER,
-                cost REAL NOT NULL,
-                profit REAL DEFAULT 0,
+                message_id INTEGER,
+                amount REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                invoice_url TEXT,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(telegram_id)
+                payment_system TEXT,
+                external_invoice_id TEXT
             )
         """)
-        
-        cursor = await db.execute("PRAGMA table_info(purchase_history)")
-        columns = [row['name'] for row in await cursor.fetchall()]
-        if 'profit' not in columns:
-            await db.execute("ALTER TABLE purchase_history ADD COLUMN profit REAL DEFAULT 0")
+    else:
+        if 'message_id' not in columns:
+            await db.execute("ALTER TABLE payments ADD COLUMN message_id INTEGER")
+        if 'payment_system' not in columns:
+            await db.execute("ALTER TABLE payments ADD COLUMN payment_system TEXT")
+        if 'external_invoice_id' not in columns:
+            await db.execute("ALTER TABLE payments ADD COLUMN external_invoice_id TEXT")
+        if 'status' not in columns:
+            await db.execute("ALTER TABLE payments ADD COLUMN status TEXT NOT NULL DEFAULT 'pending'")
+        if 'is_paid' in columns:
+            try:
+                await db.execute("UPDATE payments SET status = 'paid' WHERE is_paid = 1 AND status = 'pending'")
+                
+            except aiosqlite.OperationalError as e:
+                logging.warning(f"Could not migrate 'is_paid' column data: {e}")
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS purchase_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            purchase_type TEXT NOT NULL,
+            item_description TEXT NOT NULL,
+            amount INTEGER,
+            cost REAL NOT NULL,
+            profit REAL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(telegram_id)
+        )
+    """)
+    
+    cursor = await db.execute("PRAGMA table_info(purchase_history)")
+    columns = [row['name'] for row in await cursor.fetchall()]
+    if 'profit' not in columns:
+        await db.execute("ALTER TABLE purchase_history ADD COLUMN profit REAL DEFAULT 0")
+
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS promo_codes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT UNIQUE NOT NULL,
+            promo_type TEXT NOT NULL,
+            value REAL NOT NULL,
+            max_uses INTEGER,
+            current_uses INTEGER DEFAULT 0,
+            expires_at TIMESTAMP,
+            is_active INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS promo_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            promo_code_id INTEGER NOT NULL,
+            used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (promo_code_id) REFERENCES promo_codes(id) ON DELETE CASCADE
+        )
+    """)
+    
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    """)
+
+
+async def _migration_002_hot_path_indexes(db: aiosqlite.Connection):
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_payments_status ON payments(status)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_payments_user_status ON payments(user_id, status)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_payments_user_created ON payments(user_id, created_at)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_purchase_history_user_type ON purchase_history(user_id, purchase_type)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_purchase_history_created ON purchase_history(created_at)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_promo_history_user_promo ON promo_history(user_id, promo_code_id)")
+
+
+async def _migration_003_balance_holds(db: aiosqlite.Connection):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS balance_holds (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'held',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            settled_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(telegram_id)
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_balance_holds_status ON balance_holds(status)")
+
+
+async def backfill_daily_stats(db: aiosqlite.Connection):
+    # Rebuilds the rollups from the raw tables; the triggers keep them current afterwards.
+    await db.execute("DELETE FROM daily_stats")
+    await db.execute("""
+        INSERT INTO daily_stats (day, product, orders, quantity, revenue, profit)
+        SELECT date(created_at), purchase_type, COUNT(*), COALESCE(SUM(amount), 0), COALESCE(SUM(cost), 0), COALESCE(SUM(profit), 0)
+        FROM purchase_history
+        GROUP BY date(created_at), purchase_type
+    """)
+    await db.execute("DELETE FROM daily_users")
+    await db.execute("""
+        INSERT INTO daily_users (day, new_users)
+        SELECT date(created_at), COUNT(*) FROM users GROUP BY date(created_at)
+    """)
+
+
+async def _migration_004_daily_stats(db: aiosqlite.Connection):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT NOT NULL,
+            product TEXT NOT NULL,
+            orders INTEGER NOT NULL DEFAULT 0,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            profit REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, product)
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS daily_users (
+            day TEXT PRIMARY KEY,
+            new_users INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    # Triggers run inside the inserting transaction, so every insert path is counted.
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_purchase_history_daily_stats AFTER INSERT ON purchase_history
+        BEGIN
+            INSERT INTO daily_stats (day, product, orders, quantity, revenue, profit)
+            VALUES (date(NEW.created_at), NEW.purchase_type, 1, COALESCE(NEW.amount, 0), NEW.cost, COALESCE(NEW.profit, 0))
+            ON CONFLICT (day, product) DO UPDATE SET
+                orders = orders + 1,
+                quantity = quantity + excluded.quantity,
+                revenue = revenue + excluded.revenue,
+                profit = profit + excluded.profit;
+        END
+    """)
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_daily_users AFTER INSERT ON users
+        BEGIN
+            INSERT INTO daily_users (day, new_users) VALUES (date(NEW.created_at), 1)
+            ON CONFLICT (day) DO UPDATE SET new_users = new_users + 1;
+        END
+    """)
+    await backfill_daily_stats(db)
+
+
+async def _migration_005_history_pagination(db: aiosqlite.Connection):
+    # Keyset pagination walks these indexes from the cursor instead of skipping OFFSET rows.
+    await db.execute("DROP INDEX IF EXISTS idx_payments_user_created")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_payments_user_created_uuid ON payments(user_id, created_at, uuid)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_purchase_history_user_created ON purchase_history(user_id, created_at, id)")
+
+    cursor = await db.execute("PRAGMA table_info(users)")
+    columns = [row['name'] for row in await cursor.fetchall()]
+    if 'payments_count' not in columns:
+        await db.execute("ALTER TABLE users ADD COLUMN payments_count INTEGER NOT NULL DEFAULT 0")
+    if 'purchases_count' not in columns:
+        await db.execute("ALTER TABLE users ADD COLUMN purchases_count INTEGER NOT NULL DEFAULT 0")
+    await db.execute("""
+        UPDATE users SET
+            payments_count = (SELECT COUNT(*) FROM payments WHERE payments.user_id = users.telegram_id),
+            purchases_count = (SELECT COUNT(*) FROM purchase_history WHERE purchase_history.user_id = users.telegram_id)
+    """)
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_payments_user_count AFTER INSERT ON payments
+        BEGIN
+            UPDATE users SET payments_count = payments_count + 1 WHERE telegram_id = NEW.user_id;
+        END
+    """)
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_purchase_history_user_count AFTER INSERT ON purchase_history
+        BEGIN
+            UPDATE users SET purchases_count = purchases_count + 1 WHERE telegram_id = NEW.user_id;
+        END
+    """)
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[aiosqlite.Connection], Awaitable[None]]]] = [
+    (1, "baseline schema", _migration_001_baseline),
+    (2, "indexes for hot query paths", _migration_002_hot_path_indexes),
+    (3, "balance holds for purchases", _migration_003_balance_holds),
+    (4, "daily rollups for statistics", _migration_004_daily_stats),
+    (5, "keyset pagination indexes and per-user history counts", _migration_005_history_pagination),
+]
+
+
+async def migrate(db: aiosqlite.Connection):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor = await db.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    current_version = (await cursor.fetchone())[0]
+
+    for version, description, apply in MIGRATIONS:
+        if version <= current_version:
+            continue
+        logging.info(f"Applying database migration {version}: {description}")
+        try:
+            await apply(db)
+            await db.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)", (version, description))
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            logging.critical(f"Database migration {version} failed")
+            raise
+
+
+async def init_db(database_path: str):
+    async with aiosqlite.connect(database_path) as db:
+        db.row_factory = aiosqlite.Row
+
+        await migrate(db)
 
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS promo_codes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                code TEXT UNIQUE NOT NULL,
-                promo_type TEXT NOT NULL,
-                value REAL NOT NULL,
-                max_uses INTEGER,
-                current_uses INTEGER DEFAULT 0,
-                expires_at TIMESTAMP,
-                is_active INTEGER DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS promo_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                promo_code_id INTEGER NOT NULL,
-                used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (promo_code_id) REFERENCES promo_codes(id) ON DELETE CASCADE
-            )
-        """)
-        
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT NOT NULL
-            )
-        """)
-        
         default_settings = {
             'star_price': '1.8',
             'premium_price_0': '799',
@@ -124,8 +284,131 @@ async def init_db(database_path: str):
 
         await db.commit()
 
-async def get_db_connection(database_path: str):
-    db = await aiosqlite.connect(database_path)
-    db.row_factory = aiosqlite.Row
+class Database:
+    def __init__(self, writer: aiosqlite.Connection, readers: List[aiosqlite.Connection],
+                 group_commit_window: float = 0.005):
+        self.writer = writer
+        self.readers = readers
+        self.group_commit_window = group_commit_window
+        self._idle_readers: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        for reader in readers:
+            self._idle_readers.put_nowait(reader)
+        self._write_lock = asyncio.Lock()
+        self._in_write: ContextVar[bool] = ContextVar("in_write", default=False)
+        self._commit_future: Optional[asyncio.Future] = None
+        self._commit_task: Optional[asyncio.Task] = None
+        self._commit_deadline = 0.0
+        self._deadline_moved = asyncio.Event()
+        self._units_in_commit = 0
+
+    @classmethod
+    async def open(cls, database_path: str, readers: int, group_commit_window: float = 0.005) -> "Database":
+        writer = await aiosqlite.connect(database_path)
+        writer.row_factory = aiosqlite.Row
+        await writer.execute("PRAGMA journal_mode=WAL")
+        await writer.execute("PRAGMA synchronous=NORMAL")
+        await writer.execute("PRAGMA busy_timeout=5000")
+
+        reader_uri = f"{Path(database_path).resolve().as_uri()}?mode=ro"
+        reader_connections = []
+        for _ in range(max(1, readers)):
+            reader = await aiosqlite.connect(reader_uri, uri=True)
+            reader.row_factory = aiosqlite.Row
+            await reader.execute("PRAGMA busy_timeout=5000")
+            reader_connections.append(reader)
+
+        logging.info(f"Database opened in WAL mode with {len(reader_connections)} readers and 1 writer")
+        return cls(writer, reader_connections, group_commit_window)
+
+    async def close(self):
+        await self.flush()
+        for reader in self.readers:
+            await reader.close()
+        await self.writer.close()
+
+    async def data_version(self) -> int:
+        # Changes on this connection only when another connection, i.e. another process, commits.
+        cursor = await self.writer.execute("PRAGMA data_version")
+        return (await cursor.fetchone())[0]
+
+    @asynccontextmanager
+    async def read(self):
+        started = time.monotonic()
+        reader = await self._idle_readers.get()
+        metrics.observe("db.read_wait_seconds", time.monotonic() - started)
+        try:
+            yield reader
+        finally:
+            self._idle_readers.put_nowait(reader)
+
+    @asynccontextmanager
+    async def write(self):
+        # Nested write() calls from the same task join the outer unit instead of deadlocking on the lock.
+        if self._in_write.get():
+            yield self.writer
+            return
+
+        started = time.monotonic()
+        async with self._write_lock:
+            metrics.observe("db.write_wait_seconds", time.monotonic() - started)
+            token = self._in_write.set(True)
+            try:
+                # Each unit is a savepoint inside the shared transaction, so a failing unit
+                # rolls back alone and the others still go out with the next group commit.
+                if not self.writer.in_transaction:
+                    await self.writer.execute("BEGIN")
+                await self.writer.execute("SAVEPOINT unit")
+                try:
+                    yield self.writer
+                except BaseException:
+                    await self.writer.execute("ROLLBACK TO unit")
+                    await self.writer.execute("RELEASE unit")
+                    raise
+                await self.writer.execute("RELEASE unit")
+            finally:
+                self._in_write.reset(token)
+            self._units_in_commit += 1
+            commit_future = self._schedule_commit(self.group_commit_window)
+
+        await asyncio.shield(commit_future)
+
+    async def flush(self):
+        if self._commit_future is not None:
+            await asyncio.shield(self._schedule_commit(0))
+
+    def _schedule_commit(self, delay: float) -> asyncio.Future:
+        deadline = time.monotonic() + delay
+        if self._commit_future is None:
+            self._commit_future = asyncio.get_running_loop().create_future()
+            self._commit_deadline = deadline
+            self._commit_task = asyncio.create_task(self._commit_after())
+        elif deadline < self._commit_deadline:
+            # flush() does not wait out the rest of the group commit window.
+            self._commit_deadline = deadline
+            self._deadline_moved.set()
+        return self._commit_future
+
+    async def _commit_after(self):
+        while (remaining := self._commit_deadline - time.monotonic()) > 0:
+            self._deadline_moved.clear()
+            try:
+                await asyncio.wait_for(self._deadline_moved.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
 
-    return db
+        async with self._write_lock:
+            future, self._commit_future = self._commit_future, None
+            units, self._units_in_commit = self._units_in_commit, 0
+            started = time.monotonic()
+            try:
+                await self.writer.commit()
+            except Exception as e:
+                logging.error(f"Group commit of {units} units failed: {e}")
+                await self.writer.rollback()
+                future.set_exception(e)
+                # Mark the exception as retrieved in case no durable writer was waiting.
+                future.exception()
+                return
+            metrics.observe("db.commit_seconds", time.monotonic() - started)
+            metrics.observe("db.group_commit_units", units)
+            future.set_result(None)
@@ -2,13 +2,15 @@ import logging
 from aiogram import F, Router, types
 from services.repository import Repository
 from services.fragment_auth import FragmentAuth
+from services.fragment_sender import FragmentSender
 from services.ton_api import get_ton_balance
+from services.metrics import metrics
 from config import Config
 
 router = Router()
 
 @router.callback_query(F.data == "admin_fragment_status")
-async def fragment_status_callback(call: types.CallbackQuery, repo: Repository, config: Config):
+async def fragment_status_callback(call: types.CallbackQuery, repo: Repository, config: Config, fragment_sender: FragmentSender):
     fragment_auth = FragmentAuth(config)
     
     try:
@@ -32,12 +34,23 @@ async def fragment_status_callback(call: types.CallbackQuery, repo: Repository,
     except Exception as e:
         token_text = f"❌ Ошибка: {str(e)[:50]}"
     
+    derivation_seconds = metrics.gauges.get("ton.wallet_derivation_seconds")
+    wallet_init_text = f"{derivation_seconds * 1000:.0f} мс" if derivation_seconds is not None else "ещё не выполнена"
+
+    pool_lines = "".join(
+        f"\n• <code>{hot.address.to_str()}</code> — в работе: {hot.in_flight}"
+        for hot in fragment_sender.wallets[1:]
+    )
+    pool_text = f"\n\n<b>Дополнительные кошельки:</b>{pool_lines}" if pool_lines else ""
+
     status_text = (
         f"<b>📊 Статус Fragment</b>\n\n"
         f"<b>Авторизация:</b> {auth_text}\n"
         f"<b>Баланс кошелька:</b> {ton_balance_text}\n"
-        f"<b>Токен:</b> {token_text}\n\n"
+        f"<b>Токен:</b> {token_text}\n"
+        f"<b>Инициализация кошелька:</b> {wallet_init_text}\n\n"
         f"<b>Адрес кошелька:</b>\n<code>{config.fragment_address}</code>"
+        f"{pool_text}"
     )
     
     kb = types.InlineKeyboardMarkup(inline_keyboard=[
@@ -5,8 +5,10 @@ from aiogram.fsm.context import FSMContext
 from services.repository import Repository
 from services.ton_api import get_ton_balance
 from services.profit_calculator import ProfitCalculator
+from services.metrics import metrics
+from services.backup import send_backup
 from keyboards.admin_kb import get_admin_panel_kb
-from utils.safe_message import safe_answer, safe_answer_document, safe_delete_message
+from utils.safe_message import safe_answer, safe_delete_message
 from config import Config
 
 router = Router()
@@ -14,7 +16,7 @@ router = Router()
 @router.callback_query(F.data == "admin_panel")
 async def admin_panel_callback(call: types.CallbackQuery, state: FSMContext, repo: Repository, config: Config):
     await state.clear()
-    is_maintenance = await repo.get_setting('maintenance_mode') == '1'
+    is_maintenance = repo.get_setting('maintenance_mode') == '1'
     
     balance, error = await get_ton_balance(config.ton_wallet_address)
     balance_text = f"💎 Баланс TON: `{balance:.4f} TON`" if not error else f"💎 Баланс TON: `Ошибка: {error}`"
@@ -52,6 +54,7 @@ async def show_statistics(call: types.CallbackQuery, repo: Repository):
     
     kb = types.InlineKeyboardMarkup(inline_keyboard=[
         [types.InlineKeyboardButton(text="📈 Детальная статистика", callback_data="admin_detailed_stats")],
+        [types.InlineKeyboardButton(text="📉 Метрики", callback_data="admin_metrics")],
         [types.InlineKeyboardButton(text="💾 Выгрузить базу данных", callback_data="admin_export_db")],
         [types.InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_panel")]
     ])
@@ -115,44 +118,31 @@ async def show_detailed_statistics(call: types.CallbackQuery, repo: Repository):
             logging.error(f"Failed to edit detailed statistics message: {e}")
             await call.answer("Ошибка обновления детальной статистики", show_alert=True)
 
+@router.callback_query(F.data == "admin_metrics")
+async def show_metrics(call: types.CallbackQuery):
+    report = metrics.format_report() or "Нет данных"
+    kb = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_metrics")],
+        [types.InlineKeyboardButton(text="⬅️ К статистике", callback_data="admin_stats")]
+    ])
+    
+    try:
+        await call.message.edit_text(f"<b>📉 Метрики</b>\n\n<pre>{report[-3800:]}</pre>", reply_markup=kb)
+    except Exception as e:
+        if "message is not modified" in str(e):
+            await call.answer("Метрики уже актуальны", show_alert=False)
+        else:
+            logging.error(f"Failed to edit metrics message: {e}")
+            await call.answer("Ошибка обновления метрик", show_alert=True)
+
 @router.callback_query(F.data == "admin_export_db")
 async def export_database(call: types.CallbackQuery, config: Config):
     import os
-    import shutil
-    from datetime import datetime
-    import pytz
-    from aiogram.types import FSInputFile
     
     if not os.path.exists(config.database_path):
         await call.answer("База данных не найдена", show_alert=True)
         return
     
-    try:
-        timestamp = datetime.now(pytz.timezone('Europe/Moscow')).strftime("%Y-%m-%d_%H-%M-%S")
-        backup_filename = f"database_export_{timestamp}.db"
-        
-        shutil.copy(config.database_path, backup_filename)
-
-        document = FSInputFile(backup_filename)
-        caption = f"📊 Экспорт базы данных\n🕐 {timestamp} МСК"
-        
-        await safe_answer_document(
-            call,
-            document=document,
-            caption=caption
-        )
-
-        os.remove(backup_filename)
-        
-        await call.answer("База данных выгружена", show_alert=False)
-        
-    except Exception as e:
-        logging.error(f"Failed to export database: {e}")
-        await call.answer("Ошибка при выгрузке базы данных", show_alert=True)
-    except Exception as e:
-        if "message is not modified" in str(e):
-            await call.answer("Детальная статистика уже актуальна", show_alert=False)
-        else:
-            logging.error(f"Failed to edit detailed statistics message: {e}")
-
-            await call.answer("Ошибка обновления детальной статистики", show_alert=True)
+    await call.answer("Готовим выгрузку базы данных...", show_alert=False)
+    if not await send_backup(call.bot, config, [call.from_user.id], "📊 Экспорт базы данных", prefix="database_export"):
+        await safe_answer(call, "❌ Ошибка при выгрузке базы данных")
@@ -8,9 +8,9 @@ from keyboards.user_kb import PREMIUM_PLANS
 
 router = Router()
 
-async def get_premium_prices(repo: Repository):
+def get_premium_prices(repo: Repository):
     keys = [f'premium_price_{i}' for i in range(len(PREMIUM_PLANS))]
-    prices_db = await repo.get_multiple_settings(keys)
+    prices_db = repo.get_multiple_settings(keys)
     return [float(prices_db.get(f'premium_price_{i}', plan['price'])) for i, plan in enumerate(PREMIUM_PLANS)]
 
 @router.callback_query(F.data == "admin_prices")
@@ -19,7 +19,7 @@ async def admin_prices_menu(call: types.CallbackQuery):
 
 @router.callback_query(F.data == "price_stars")
 async def price_stars_show(call: types.CallbackQuery, state: FSMContext, repo: Repository):
-    star_price = await repo.get_setting('star_price')
+    star_price = repo.get_setting('star_price')
     await call.message.edit_text(
         text=f"<b>⭐ Текущая цена за 1 звезду:</b> <code>{star_price}</code> ₽\n\nВведите новую цену:",
         reply_markup=types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_prices")]])
@@ -40,7 +40,7 @@ async def price_stars_input_msg(message: types.Message, state: FSMContext, repo:
 
 @router.callback_query(F.data == "price_premium")
 async def price_premium_choose(call: types.CallbackQuery, state: FSMContext, repo: Repository):
-    premium_prices = await get_premium_prices(repo)
+    premium_prices = get_premium_prices(repo)
     await call.message.edit_text(
         text="<b>💎 Выберите тариф для изменения цены:</b>",
         reply_markup=get_premium_prices_kb(premium_prices)
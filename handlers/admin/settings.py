@@ -13,7 +13,7 @@ router = Router()
 
 @router.callback_query(MaintenanceCallback.filter(F.action == "toggle"))
 async def toggle_maintenance_mode(call: types.CallbackQuery, repo: Repository):
-    is_maintenance_old = await repo.get_setting('maintenance_mode') == '1'
+    is_maintenance_old = repo.get_setting('maintenance_mode') == '1'
     new_status = not is_maintenance_old
     
     await repo.update_setting('maintenance_mode', '1' if new_status else '0')
@@ -21,7 +21,7 @@ async def toggle_maintenance_mode(call: types.CallbackQuery, repo: Repository):
     status_text = "ВКЛЮЧЕН" if new_status else "ВЫКЛЮЧЕН"
     await call.answer(f"Режим технического перерыва {status_text}", show_alert=True)
     
-    is_maintenance_new = await repo.get_setting('maintenance_mode') == '1'
+    is_maintenance_new = repo.get_setting('maintenance_mode') == '1'
     await call.message.edit_reply_markup(reply_markup=get_admin_panel_kb(is_maintenance_new))
 
 @router.callback_query(F.data == "admin_settings")
@@ -67,7 +67,7 @@ async def settings_process_new_text(message: types.Message, state: FSMContext, r
     
 @router.callback_query(F.data == "settings_support_menu")
 async def settings_support_menu(call: types.CallbackQuery, repo: Repository):
-    contact = await repo.get_setting('support_contact') or "Не задан"
+    contact = repo.get_setting('support_contact') or "Не задан"
     await call.message.edit_text(f"<b>🆘 Управление поддержкой</b>\n\nТекущий контакт: @{contact}", reply_markup=get_settings_support_kb())
 
 @router.callback_query(F.data == "settings_edit_support")
@@ -88,7 +88,7 @@ async def settings_process_new_support(message: types.Message, state: FSMContext
 
 @router.callback_query(F.data == "settings_channel_menu")
 async def settings_channel_menu(call: types.CallbackQuery, repo: Repository):
-    settings = await repo.get_multiple_settings(['news_channel_link', 'force_subscribe'])
+    settings = repo.get_multiple_settings(['news_channel_link', 'force_subscribe'])
     channel_link = settings.get('news_channel_link')
     channel_display = channel_link or "Не задан"
     is_forced = settings.get('force_subscribe') == '1'
@@ -131,7 +131,7 @@ async def settings_process_channel_forward(message: types.Message, state: FSMCon
         
         await message.answer(f"✅ Канал '{message.forward_from_chat.title}' успешно привязан.")
         
-        settings = await repo.get_multiple_settings(['news_channel_link', 'force_subscribe'])
+        settings = repo.get_multiple_settings(['news_channel_link', 'force_subscribe'])
         channel_link = settings.get('news_channel_link')
         channel_display = channel_link or "Не задан"
         is_forced = settings.get('force_subscribe') == '1'
@@ -150,7 +150,7 @@ async def settings_process_channel_forward(message: types.Message, state: FSMCon
 
 @router.callback_query(F.data == "settings_toggle_subscribe")
 async def settings_toggle_subscribe(call: types.CallbackQuery, repo: Repository):
-    is_forced = await repo.get_setting('force_subscribe') == '1'
+    is_forced = repo.get_setting('force_subscribe') == '1'
     new_status = not is_forced
     await repo.update_setting('force_subscribe', '1' if new_status else '0')
     
@@ -6,6 +6,7 @@ import logging
 from services.repository import Repository
 from states.admin import AdminUserManagementStates
 from keyboards.admin_kb import get_user_info_kb, get_user_payments_kb, UserPaymentsCallback, AdminUserNavCallback
+from utils.pagination import get_page_cursor, save_page_cursor
 
 router = Router()
 PAGE_SIZE = 5
@@ -182,7 +183,7 @@ async def admin_take_balance_confirm(call: types.CallbackQuery, state: FSMContex
 async def view_user_payments(call: types.CallbackQuery, callback_data: UserPaymentsCallback, state: FSMContext, repo: Repository):
     data = await state.get_data()
     user_id = data.get("target_user_id")
-    page = callback_data.page
+    page, after = await get_page_cursor(state, "payments_cursors", callback_data.page)
     
     total_payments = await repo.count_user_payments(user_id)
     text = f"🧾 История пополнений пользователя <code>{user_id}</code>\n\n"
@@ -192,7 +193,9 @@ async def view_user_payments(call: types.CallbackQuery, callback_data: UserPayme
         kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="⬅️ Назад к профилю", callback_data=AdminUserNavCallback(action="back_to_menu", target_user_id=user_id).pack())]])
     else:
         max_page = (total_payments + PAGE_SIZE - 1) // PAGE_SIZE
-        payments = await repo.get_user_payments_page(user_id, page, PAGE_SIZE)
+        payments = await repo.get_user_payments_page(user_id, PAGE_SIZE, after)
+        if payments:
+            await save_page_cursor(state, "payments_cursors", page, [payments[-1]['created_at'], payments[-1]['uuid']])
         
         status_map = {
             'paid': '✅ Оплачен',
@@ -37,7 +37,7 @@ async def calc_by_stars_process(message: types.Message, state: FSMContext, repo:
         await message.answer("❗️ Пожалуйста, введите целое число.")
         return
 
-    star_price_str = await repo.get_setting('star_price')
+    star_price_str = repo.get_setting('star_price')
     star_price = float(star_price_str) if star_price_str else 1.8
     total_cost = round(stars_amount * star_price, 2)
     
@@ -60,7 +60,7 @@ async def calc_by_rub_process(message: types.Message, state: FSMContext, repo: R
         await message.answer("❗️ Пожалуйста, введите корректное положительное число.")
         return
 
-    star_price_str = await repo.get_setting('star_price')
+    star_price_str = repo.get_setting('star_price')
     star_price = float(star_price_str) if star_price_str else 1.8
     if star_price == 0:
         await message.answer("❗️ Невозможно рассчитать, так как цена звезды равна нулю.")
@@ -9,12 +9,15 @@ from payments.cryptobot import create_cryptopay_invoice, get_usdt_rub_rate
 from payments.lolzteam import create_lzt_payment_link
 from payments.crystalpay import create_crystalpay_invoice
 from payments.payment_manager import PaymentManager
+from services.payment_monitor import PaymentMonitor
 from keyboards import user_kb
 from states.user import TopupCryptoPayStates, TopupLztStates, TopupCrystalPayStates, PromoUserStates
-from utils.safe_message import safe_answer_photo, safe_answer, safe_delete_message
+from utils.pagination import get_page_cursor, save_page_cursor
+from utils.safe_message import safe_answer_photo, safe_answer, safe_delete_message, safe_edit_message
 from .start import show_main_menu
 
 router = Router()
+HISTORY_PAGE_SIZE = 5
 
 @router.callback_query(F.data == "profile")
 async def profile_callback(call: types.CallbackQuery, repo: Repository, config: Config):
@@ -39,6 +42,43 @@ async def profile_callback(call: types.CallbackQuery, repo: Repository, config:
         reply_markup=user_kb.get_profile_kb()
     )
 
+@router.callback_query(user_kb.HistoryCallback.filter())
+async def profile_history_callback(call: types.CallbackQuery, callback_data: user_kb.HistoryCallback, state: FSMContext, repo: Repository):
+    user_id = call.from_user.id
+    page, after = await get_page_cursor(state, "history_cursors", callback_data.page)
+    total = await repo.count_user_history(user_id)
+    back_kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="⬅️ Назад в профиль", callback_data="profile")]])
+
+    if total == 0:
+        await safe_edit_message(call, "🧾 <b>История пополнений и покупок</b>\n\nЗдесь пока пусто.", reply_markup=back_kb)
+        return
+
+    rows = await repo.get_user_history_page(user_id, HISTORY_PAGE_SIZE, after)
+    if rows:
+        await save_page_cursor(state, "history_cursors", page, [rows[-1]['created_at'], rows[-1]['kind'], rows[-1]['ref']])
+
+    status_map = {
+        'paid': '✅ Оплачен',
+        'pending': '⏳ Ожидает',
+        'cancelled': '❌ Отменен',
+        'expired': '⌛️ Истек'
+    }
+    lines = []
+    for row in rows:
+        date_formatted = datetime.fromisoformat(row['created_at']).strftime('%d.%m.%Y %H:%M')
+        if row['kind'] == 'payment':
+            payment_system = row['details'].capitalize() if row['details'] else 'N/A'
+            lines.append(
+                f"💰 Пополнение <b>+{row['amount']:.2f} ₽</b> ({payment_system}) - {status_map.get(row['status'], row['status'])}\n"
+                f"   {date_formatted}"
+            )
+        else:
+            lines.append(f"🛒 {row['details']} <b>-{row['amount']:.2f} ₽</b>\n   {date_formatted}")
+
+    max_page = (total + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE
+    text = "🧾 <b>История пополнений и покупок</b>\n\n" + "\n\n".join(lines)
+    await safe_edit_message(call, text, reply_markup=user_kb.get_history_kb(page, max_page))
+
 @router.callback_query(F.data == "profile_topup_menu")
 async def profile_topup_menu_callback(call: types.CallbackQuery, config: Config):
     await safe_delete_message(call)
@@ -54,7 +94,6 @@ async def pre_topup_checks(call: types.CallbackQuery, repo: Repository, state: F
         await call.answer("У вас уже есть активный счет. Завершите или отмените его, чтобы создать новый.", show_alert=True)
         return False
     await state.clear()
-    await repo.mark_old_payments_as_expired(call.from_user.id)
     return True
 
 @router.callback_query(F.data == "topup_cryptobot")
@@ -100,11 +139,12 @@ async def topup_cryptopay_amount(message: types.Message, state: FSMContext, repo
     await state.clear()
 
 @router.callback_query(F.data.startswith("cancel_db_payment_"))
-async def cancel_db_payment_callback(call: types.CallbackQuery, repo: Repository):
+async def cancel_db_payment_callback(call: types.CallbackQuery, repo: Repository, payment_monitor: PaymentMonitor):
     order_id = call.data.replace("cancel_db_payment_", "", 1)
     status_was_updated = await repo.update_payment_status(order_id, 'cancelled')
     
     if status_was_updated:
+        payment_monitor.forget(order_id)
         await call.answer("Счет отменен.")
         try:
             await call.message.edit_text("✅ Счет успешно отменен.", reply_markup=None)
@@ -117,6 +157,17 @@ async def cancel_db_payment_callback(call: types.CallbackQuery, repo: Repository
         except Exception:
             pass
 
+@router.callback_query(F.data.startswith("check_payment_"))
+async def check_payment_callback(call: types.CallbackQuery, payment_monitor: PaymentMonitor):
+    order_id = call.data.replace("check_payment_", "", 1)
+    result = await payment_monitor.check_now(order_id, call.from_user.id)
+    if result is None:
+        await call.answer("Этот счет уже недействителен.", show_alert=True)
+    elif result:
+        await call.answer("✅ Оплата получена!")
+    else:
+        await call.answer("⏳ Оплата пока не поступила. Если вы уже оплатили, проверьте ещё раз через несколько секунд.", show_alert=True)
+
 @router.callback_query(F.data == "topup_lzt")
 async def topup_lzt_handler(call: types.CallbackQuery, state: FSMContext, config: Config, repo: Repository):
     if not await pre_topup_checks(call, repo, state):
@@ -142,6 +193,7 @@ async def process_lzt_amount(message: types.Message, state: FSMContext, config:
     
     kb = types.InlineKeyboardMarkup(inline_keyboard=[
         [types.InlineKeyboardButton(text="🔗 Перейти к оплате", url=payment_link)],
+        [types.InlineKeyboardButton(text="🔄 Проверить оплату", callback_data=f"check_payment_{order_id}")],
         [types.InlineKeyboardButton(text="❌ Отменить", callback_data=f"cancel_db_payment_{order_id}")]
     ])
     
@@ -178,6 +230,7 @@ async def process_crystalpay_amount(message: types.Message, state: FSMContext, c
 
     kb = types.InlineKeyboardMarkup(inline_keyboard=[
         [types.InlineKeyboardButton(text="🔮 Оплатить через CrystalPay", url=payment_url)],
+        [types.InlineKeyboardButton(text="🔄 Проверить оплату", callback_data=f"check_payment_{order_id}")],
         [types.InlineKeyboardButton(text="❌ Отменить", callback_data=f"cancel_db_payment_{order_id}")]
     ])
     
@@ -5,6 +5,7 @@ from aiogram.fsm.context import FSMContext
 
 from services.repository import Repository
 from services.fragment_sender import FragmentSender
+from services.fulfillment import FulfillmentQueue, FulfillmentOrder
 from services.profit_calculator import ProfitCalculator
 from keyboards import user_kb
 from states.user import BuyPremiumStates
@@ -15,9 +16,9 @@ from utils.safe_message import safe_delete_and_send_photo, safe_edit_message
 
 router = Router()
 
-async def get_premium_prices(repo: Repository):
+def get_premium_prices(repo: Repository):
     keys = [f'premium_price_{i}' for i in range(len(PREMIUM_PLANS))]
-    prices_db = await repo.get_multiple_settings(keys)
+    prices_db = repo.get_multiple_settings(keys)
     return [float(prices_db.get(f'premium_price_{i}', plan['price'])) for i, plan in enumerate(PREMIUM_PLANS)]
 
 @router.callback_query(F.data == "buy_premium")
@@ -32,15 +33,15 @@ async def buy_premium_callback(call: types.CallbackQuery, state: FSMContext, con
 @router.callback_query(F.data == "buy_premium_self")
 async def buy_premium_self_callback(call: types.CallbackQuery, repo: Repository):
     user = await repo.get_user(call.from_user.id)
-    premium_prices = await get_premium_prices(repo)
+    premium_prices = get_premium_prices(repo)
     kb = user_kb.get_premium_plans_kb(premium_prices, user["discount"], prefix="buy_premium_self_plan", back_target="buy_premium")
     await safe_edit_message(call, text="<b>Выберите тариф для себя:</b>", reply_markup=kb)
 
 @router.callback_query(F.data.startswith("buy_premium_self_plan_"))
-async def buy_premium_self_plan_selected(call: types.CallbackQuery, state: FSMContext, repo: Repository):
+async def buy_premium_self_plan_selected(call: types.CallbackQuery, state: FSMContext, repo: Repository, fragment_sender: FragmentSender):
     plan_index = int(call.data.split("_")[-1])
     plan = PREMIUM_PLANS[plan_index]
-    premium_prices = await get_premium_prices(repo)
+    premium_prices = get_premium_prices(repo)
     price = premium_prices[plan_index]
     user = await repo.get_user(call.from_user.id)
     discount = user["discount"]
@@ -56,9 +57,11 @@ async def buy_premium_self_plan_selected(call: types.CallbackQuery, state: FSMCo
     kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="✅ Подтвердить", callback_data="buy_premium_self_confirm")], [types.InlineKeyboardButton(text="⬅️ Назад", callback_data="buy_premium_self")]])
     await safe_edit_message(call, text=f"{text}\n\nПодтвердить покупку?", reply_markup=kb)
     await state.set_state(BuyPremiumStates.waiting_for_self_confirm)
+    if call.from_user.username:
+        fragment_sender.prefetch(call.from_user.id, "premium", call.from_user.username, plan["duration"] // 30)
 
 @router.callback_query(BuyPremiumStates.waiting_for_self_confirm, F.data == "buy_premium_self_confirm")
-async def buy_premium_self_confirm_callback(call: types.CallbackQuery, state: FSMContext, repo: Repository, fragment_sender: FragmentSender):
+async def buy_premium_self_confirm_callback(call: types.CallbackQuery, state: FSMContext, repo: Repository, fulfillment: FulfillmentQueue, fragment_sender: FragmentSender):
     if not call.from_user.username:
         await call.answer("У вас нету логина в тг, установите его и попробуйте еще раз", show_alert=True)
         await state.clear()
@@ -68,30 +71,42 @@ async def buy_premium_self_confirm_callback(call: types.CallbackQuery, state: FS
     plan_index, total = data.get("plan_index"), data.get("total")
     plan = PREMIUM_PLANS[plan_index]
     user_obj = call.from_user
-    user_db = await repo.get_user(user_obj.id)
 
-    if float(user_db["balance"]) < total:
-        await safe_edit_message(call, text=f"Недостаточно средств! Не хватает: <b>{total - float(user_db['balance'])}₽</b>", reply_markup=types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="💰 Пополнить баланс", callback_data="profile_topup")]]))
+    if not fragment_sender.is_available():
+        error_kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]])
+        await safe_edit_message(call, text="⚠️ Fragment временно не отвечает. Попробуйте через пару минут, средства не списаны.", reply_markup=error_kb)
         await state.clear()
         return
 
-    success_text_template = await repo.get_setting('purchase_success_text')
-    success_text = format_text_with_user_data(success_text_template, user_obj)
-    
     months = plan["duration"] // 30
     profit_calc = ProfitCalculator()
     cost_ton, profit_rub = await profit_calc.calculate_premium_profit(months, total)
-    
-    await repo.update_user_balance(user_obj.id, total, operation='sub')
-    
-    success = await fragment_sender.send_premium(call.from_user.username, months)
-    
-    if success:
-        await repo.update_user_discount(user_obj.id, None) 
-        await repo.add_purchase_to_history(user_obj.id, 'premium', plan['name'], months, total, profit_rub)
-        final_message = f"{success_text}\n\nПремиум <b>{plan['name']}</b> успешно активирован!"
-        await safe_edit_message(call, text=final_message, reply_markup=None)
-        
+
+    reservation = await fragment_sender.reserve(cost_ton)
+    if reservation is None:
+        error_kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]])
+        await safe_edit_message(call, text="⚠️ Покупка временно недоступна. Попробуйте позже, средства не списаны.", reply_markup=error_kb)
+        await state.clear()
+        return
+
+    try:
+        hold_id = await repo.hold(user_obj.id, total)
+    except Exception:
+        reservation.wallet.release(reservation)
+        raise
+    if hold_id is None:
+        reservation.wallet.release(reservation)
+        user_db = await repo.get_user(user_obj.id)
+        error_message = f"Недостаточно средств! Не хватает: <b>{total - float(user_db['balance'])}₽</b>"
+        error_kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="💰 Пополнить баланс", callback_data="profile_topup")]])
+        await safe_edit_message(call, text=error_message, reply_markup=error_kb)
+        await state.clear()
+        return
+
+    try:
+        success_text_template = repo.get_setting('purchase_success_text')
+        success_text = format_text_with_user_data(success_text_template, user_obj)
+
         profit_text = (
             f"💎 <b>Новая продажа премиума</b>\n\n"
             f"👤 Покупатель: @{call.from_user.username}\n"
@@ -100,11 +115,31 @@ async def buy_premium_self_confirm_callback(call: types.CallbackQuery, state: FS
             f"📈 Прибыль: {profit_rub:.2f}₽\n"
             f"📊 Маржа: {profit_calc.get_profit_margin(total - profit_rub, total):.1f}%"
         )
-        await fragment_sender._notify_admins(profit_text)
-    else:
-        await repo.update_user_balance(user_obj.id, total, operation='add')
-        error_kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]])
-        await safe_edit_message(call, text="❌ Произошла ошибка при отправке премиума. Средства возвращены на ваш баланс. Обратитесь в поддержку.", reply_markup=error_kb)
+
+        await call.answer()
+        await safe_edit_message(call, text="⏳ Заказ принят в обработку. Премиум будет активирован в ближайшее время.", reply_markup=None)
+        await fulfillment.submit(FulfillmentOrder(
+            user_id=user_obj.id,
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            is_photo=bool(call.message.photo),
+            product='premium',
+            recipient=call.from_user.username,
+            quantity=months,
+            total=total,
+            profit=profit_rub,
+            history_description=plan['name'],
+            success_text=f"{success_text}\n\nПремиум <b>{plan['name']}</b> успешно активирован!",
+            failure_text="❌ Произошла ошибка при отправке премиума. Средства возвращены на ваш баланс. Обратитесь в поддержку.",
+            admin_text=profit_text,
+            hold_id=hold_id,
+            reservation=reservation,
+        ))
+    except Exception:
+        # Nothing reached the fulfillment queue, so give back both the hold and the TON reservation.
+        await repo.release(hold_id)
+        reservation.wallet.release(reservation)
+        raise
     await state.clear()
 
 @router.callback_query(F.data == "buy_premium_gift")
@@ -124,7 +159,7 @@ async def process_premium_gift_recipient(message: types.Message, state: FSMConte
     await state.update_data(recipient=recipient)
     
     user = await repo.get_user(message.from_user.id)
-    premium_prices = await get_premium_prices(repo)
+    premium_prices = get_premium_prices(repo)
     kb = user_kb.get_premium_plans_kb(premium_prices, user["discount"], prefix="buy_premium_gift_plan", back_target="buy_premium_gift")
     
     await message.delete()
@@ -136,10 +171,10 @@ async def process_premium_gift_recipient(message: types.Message, state: FSMConte
     await state.set_state(BuyPremiumStates.waiting_for_gift_plan)
 
 @router.callback_query(BuyPremiumStates.waiting_for_gift_plan, F.data.startswith("buy_premium_gift_plan_"))
-async def buy_premium_gift_plan_selected(call: types.CallbackQuery, state: FSMContext, repo: Repository):
+async def buy_premium_gift_plan_selected(call: types.CallbackQuery, state: FSMContext, repo: Repository, fragment_sender: FragmentSender):
     plan_index = int(call.data.split("_")[-1])
     plan = PREMIUM_PLANS[plan_index]
-    premium_prices = await get_premium_prices(repo)
+    premium_prices = get_premium_prices(repo)
     price = premium_prices[plan_index]
     user = await repo.get_user(call.from_user.id)
     data = await state.get_data()
@@ -157,36 +192,49 @@ async def buy_premium_gift_plan_selected(call: types.CallbackQuery, state: FSMCo
     kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="✅ Подтвердить", callback_data="buy_premium_gift_confirm")], [types.InlineKeyboardButton(text="⬅️ Назад", callback_data="buy_premium_gift")]])
     await safe_edit_message(call, text=f"{text}\n\nПодтвердить покупку?", reply_markup=kb)
     await state.set_state(BuyPremiumStates.waiting_for_gift_confirm)
+    fragment_sender.prefetch(call.from_user.id, "premium", recipient, plan["duration"] // 30)
 
 @router.callback_query(BuyPremiumStates.waiting_for_gift_confirm, F.data == "buy_premium_gift_confirm")
-async def buy_premium_gift_confirm_callback(call: types.CallbackQuery, state: FSMContext, repo: Repository, fragment_sender: FragmentSender):
+async def buy_premium_gift_confirm_callback(call: types.CallbackQuery, state: FSMContext, repo: Repository, fulfillment: FulfillmentQueue, fragment_sender: FragmentSender):
     data = await state.get_data()
     plan_index, total, recipient = data.get("plan_index"), data.get("total"), data.get("recipient")
     plan = PREMIUM_PLANS[plan_index]
     user_obj = call.from_user
-    user_db = await repo.get_user(user_obj.id)
 
-    if float(user_db["balance"]) < total:
-        await safe_edit_message(call, text=f"Недостаточно средств! Не хватает: <b>{total - float(user_db['balance'])}₽</b>", reply_markup=types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="💰 Пополнить баланс", callback_data="profile_topup")]]))
+    if not fragment_sender.is_available():
+        error_kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]])
+        await safe_edit_message(call, text="⚠️ Fragment временно не отвечает. Попробуйте через пару минут, средства не списаны.", reply_markup=error_kb)
         await state.clear()
         return
 
-    success_text_template = await repo.get_setting('purchase_success_text')
-    success_text = format_text_with_user_data(success_text_template, user_obj)
-
     months = plan["duration"] // 30
     profit_calc = ProfitCalculator()
     cost_ton, profit_rub = await profit_calc.calculate_premium_profit(months, total)
-    
-    await repo.update_user_balance(user_obj.id, total, operation='sub')
-    
-    success = await fragment_sender.send_premium(recipient, months)
-    
-    if success:
-        await repo.update_user_discount(user_obj.id, None) 
-        await repo.add_purchase_to_history(user_obj.id, 'premium', f"{plan['name']} for @{recipient}", months, total, profit_rub)
-        final_message = f"{success_text}\n\nПремиум <b>{plan['name']}</b> для <code>@{recipient}</code> успешно куплен!"
-        await safe_edit_message(call, text=final_message, reply_markup=None)
+
+    reservation = await fragment_sender.reserve(cost_ton)
+    if reservation is None:
+        error_kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]])
+        await safe_edit_message(call, text="⚠️ Покупка временно недоступна. Попробуйте позже, средства не списаны.", reply_markup=error_kb)
+        await state.clear()
+        return
+
+    try:
+        hold_id = await repo.hold(user_obj.id, total)
+    except Exception:
+        reservation.wallet.release(reservation)
+        raise
+    if hold_id is None:
+        reservation.wallet.release(reservation)
+        user_db = await repo.get_user(user_obj.id)
+        error_message = f"Недостаточно средств! Не хватает: <b>{total - float(user_db['balance'])}₽</b>"
+        error_kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="💰 Пополнить баланс", callback_data="profile_topup")]])
+        await safe_edit_message(call, text=error_message, reply_markup=error_kb)
+        await state.clear()
+        return
+
+    try:
+        success_text_template = repo.get_setting('purchase_success_text')
+        success_text = format_text_with_user_data(success_text_template, user_obj)
 
         profit_text = (
             f"🎁 <b>Новый подарок премиума</b>\n\n"
@@ -197,9 +245,29 @@ async def buy_premium_gift_confirm_callback(call: types.CallbackQuery, state: FS
             f"📈 Прибыль: {profit_rub:.2f}₽\n"
             f"📊 Маржа: {profit_calc.get_profit_margin(total - profit_rub, total):.1f}%"
         )
-        await fragment_sender._notify_admins(profit_text)
-    else:
-        await repo.update_user_balance(user_obj.id, total, operation='add')
-        error_kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]])
-        await safe_edit_message(call, text="❌ Произошла ошибка при отправке премиума. Средства возвращены на ваш баланс. Обратитесь в поддержку.", reply_markup=error_kb)
+
+        await call.answer()
+        await safe_edit_message(call, text=f"⏳ Заказ принят в обработку. Премиум для <code>@{recipient}</code> будет активирован в ближайшее время.", reply_markup=None)
+        await fulfillment.submit(FulfillmentOrder(
+            user_id=user_obj.id,
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            is_photo=bool(call.message.photo),
+            product='premium',
+            recipient=recipient,
+            quantity=months,
+            total=total,
+            profit=profit_rub,
+            history_description=f"{plan['name']} for @{recipient}",
+            success_text=f"{success_text}\n\nПремиум <b>{plan['name']}</b> для <code>@{recipient}</code> успешно куплен!",
+            failure_text="❌ Произошла ошибка при отправке премиума. Средства возвращены на ваш баланс. Обратитесь в поддержку.",
+            admin_text=profit_text,
+            hold_id=hold_id,
+            reservation=reservation,
+        ))
+    except Exception:
+        # Nothing reached the fulfillment queue, so give back both the hold and the TON reservation.
+        await repo.release(hold_id)
+        reservation.wallet.release(reservation)
+        raise
     await state.clear()
@@ -6,6 +6,7 @@ from aiogram.exceptions import TelegramBadRequest
 
 from services.repository import Repository
 from services.fragment_sender import FragmentSender
+from services.fulfillment import FulfillmentQueue, FulfillmentOrder
 from services.profit_calculator import ProfitCalculator
 from keyboards import user_kb
 from states.user import BuyStarsGiftStates, BuyStarsSelfStates, BuyStarsConfirmStates
@@ -38,7 +39,7 @@ async def buy_stars_self_amount_callback(call: types.CallbackQuery, state: FSMCo
     await state.set_state(BuyStarsSelfStates.waiting_for_self_amount)
 
 @router.message(BuyStarsSelfStates.waiting_for_self_amount)
-async def process_self_amount(message: types.Message, state: FSMContext, repo: Repository):
+async def process_self_amount(message: types.Message, state: FSMContext, repo: Repository, fragment_sender: FragmentSender):
     try:
         amount = int(message.text)
         if amount < 50:
@@ -48,7 +49,7 @@ async def process_self_amount(message: types.Message, state: FSMContext, repo: R
         await message.answer("❗ Введите целое число.")
         return
 
-    star_price = float(await repo.get_setting('star_price'))
+    star_price = float(repo.get_setting('star_price'))
     total = round(amount * star_price, 2)
     user = await repo.get_user(message.from_user.id)
     discount = user["discount"]
@@ -64,19 +65,21 @@ async def process_self_amount(message: types.Message, state: FSMContext, repo: R
     kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="✅ Подтвердить", callback_data="buy_stars_self_confirm")], [types.InlineKeyboardButton(text="⬅️ Назад", callback_data="buy_stars_self")]])
     await message.answer(f"{price_text}\n\nПодтвердить покупку?", reply_markup=kb)
     await state.set_state(BuyStarsConfirmStates.waiting_for_confirm)
+    if message.from_user.username:
+        fragment_sender.prefetch(message.from_user.id, "stars", message.from_user.username, amount)
 
 @router.callback_query(F.data == "buy_stars_self_packs")
 @router.callback_query(F.data.startswith("buy_stars_self_packs_page_"))
 async def buy_stars_self_packs_callback(call: types.CallbackQuery, repo: Repository):
     page = int(call.data.split("_")[-1]) if "page" in call.data else 0
     user = await repo.get_user(call.from_user.id)
-    star_price = float(await repo.get_setting('star_price'))
+    star_price = float(repo.get_setting('star_price'))
     await safe_edit_message(call, text="<b>Выберите готовый пакет звёзд:</b>", reply_markup=user_kb.get_star_packs_kb(page, "buy_stars_self", star_price, user["discount"], back_target="buy_stars_self"))
 
 @router.callback_query(F.data.startswith("buy_stars_self_pack_"))
-async def buy_stars_self_pack_selected(call: types.CallbackQuery, state: FSMContext, repo: Repository):
+async def buy_stars_self_pack_selected(call: types.CallbackQuery, state: FSMContext, repo: Repository, fragment_sender: FragmentSender):
     amount = int(call.data.split("_")[-1])
-    star_price = float(await repo.get_setting('star_price'))
+    star_price = float(repo.get_setting('star_price'))
     total = round(amount * star_price, 2)
     user = await repo.get_user(call.from_user.id)
     discount = user["discount"]
@@ -92,9 +95,11 @@ async def buy_stars_self_pack_selected(call: types.CallbackQuery, state: FSMCont
     kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="✅ Подтвердить", callback_data="buy_stars_self_confirm")], [types.InlineKeyboardButton(text="⬅️ Назад", callback_data="buy_stars_self_packs")]])
     await safe_edit_message(call, text=f"{price_text}\n\nПодтвердить покупку?", reply_markup=kb)
     await state.set_state(BuyStarsConfirmStates.waiting_for_confirm)
+    if call.from_user.username:
+        fragment_sender.prefetch(call.from_user.id, "stars", call.from_user.username, amount)
 
 @router.callback_query(BuyStarsConfirmStates.waiting_for_confirm, F.data == "buy_stars_self_confirm")
-async def buy_stars_self_confirm_callback(call: types.CallbackQuery, state: FSMContext, repo: Repository, fragment_sender: FragmentSender):
+async def buy_stars_self_confirm_callback(call: types.CallbackQuery, state: FSMContext, repo: Repository, fulfillment: FulfillmentQueue, fragment_sender: FragmentSender):
     if not call.from_user.username:
         await call.answer("У вас нету логина в тг, установите его и попробуйте еще раз", show_alert=True)
         await state.clear()
@@ -103,30 +108,41 @@ async def buy_stars_self_confirm_callback(call: types.CallbackQuery, state: FSMC
     data = await state.get_data()
     amount, total = data.get("amount"), data.get("total")
     user_obj = call.from_user
-    user_db = await repo.get_user(user_obj.id)
 
-    if float(user_db["balance"]) < total:
+    if not fragment_sender.is_available():
+        error_kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]])
+        await safe_edit_message(call, text="⚠️ Fragment временно не отвечает. Попробуйте через пару минут, средства не списаны.", reply_markup=error_kb)
+        await state.clear()
+        return
+
+    profit_calc = ProfitCalculator()
+    cost_ton, profit_rub = await profit_calc.calculate_stars_profit(amount, total)
+
+    reservation = await fragment_sender.reserve(cost_ton)
+    if reservation is None:
+        error_kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]])
+        await safe_edit_message(call, text="⚠️ Покупка временно недоступна. Попробуйте позже, средства не списаны.", reply_markup=error_kb)
+        await state.clear()
+        return
+
+    try:
+        hold_id = await repo.hold(user_obj.id, total)
+    except Exception:
+        reservation.wallet.release(reservation)
+        raise
+    if hold_id is None:
+        reservation.wallet.release(reservation)
+        user_db = await repo.get_user(user_obj.id)
         error_message = f"Недостаточно средств! Не хватает: <b>{total - float(user_db['balance'])}₽</b>"
         error_kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="💰 Пополнить баланс", callback_data="profile_topup")]])
         await safe_edit_message(call, text=error_message, reply_markup=error_kb)
         await state.clear()
         return
-        
-    profit_calc = ProfitCalculator()
-    cost_ton, profit_rub = await profit_calc.calculate_stars_profit(amount, total)
-    
-    success_text_template = await repo.get_setting('purchase_success_text')
-    success_text = format_text_with_user_data(success_text_template, user_obj)
-    
-    await repo.update_user_balance(user_obj.id, total, operation='sub')
-    
-    success = await fragment_sender.send_stars(call.from_user.username, amount)
-    
-    if success:
-        await repo.update_user_discount(user_obj.id, None)
-        await repo.add_purchase_to_history(user_obj.id, 'stars', f'{amount} Stars', amount, total, profit_rub)
-        await safe_edit_message(call, text=success_text, reply_markup=None)
-        
+
+    try:
+        success_text_template = repo.get_setting('purchase_success_text')
+        success_text = format_text_with_user_data(success_text_template, user_obj)
+
         profit_text = (
             f"💰 <b>Новая продажа звёзд</b>\n\n"
             f"👤 Покупатель: @{call.from_user.username}\n"
@@ -135,11 +151,31 @@ async def buy_stars_self_confirm_callback(call: types.CallbackQuery, state: FSMC
             f"📈 Прибыль: {profit_rub:.2f}₽\n"
             f"📊 Маржа: {profit_calc.get_profit_margin(total - profit_rub, total):.1f}%"
         )
-        await fragment_sender._notify_admins(profit_text)
-    else:
-        await repo.update_user_balance(user_obj.id, total, operation='add')
-        error_kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]])
-        await safe_edit_message(call, text="❌ Произошла ошибка при отправке звёзд. Средства возвращены на ваш баланс. Обратитесь в поддержку.", reply_markup=error_kb)
+
+        await call.answer()
+        await safe_edit_message(call, text="⏳ Заказ принят в обработку. Звёзды будут отправлены в ближайшее время.", reply_markup=None)
+        await fulfillment.submit(FulfillmentOrder(
+            user_id=user_obj.id,
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            is_photo=bool(call.message.photo),
+            product='stars',
+            recipient=call.from_user.username,
+            quantity=amount,
+            total=total,
+            profit=profit_rub,
+            history_description=f'{amount} Stars',
+            success_text=success_text,
+            failure_text="❌ Произошла ошибка при отправке звёзд. Средства возвращены на ваш баланс. Обратитесь в поддержку.",
+            admin_text=profit_text,
+            hold_id=hold_id,
+            reservation=reservation,
+        ))
+    except Exception:
+        # Nothing reached the fulfillment queue, so give back both the hold and the TON reservation.
+        await repo.release(hold_id)
+        reservation.wallet.release(reservation)
+        raise
     await state.clear()
 
 @router.callback_query(F.data == "buy_stars_gift")
@@ -183,20 +219,24 @@ async def buy_stars_gift_packs_callback(call: types.CallbackQuery, state: FSMCon
     page = int(call.data.split("_")[-1]) if "page" in call.data else 0
     data = await state.get_data()
     user = await repo.get_user(call.from_user.id)
-    star_price = float(await repo.get_setting('star_price'))
+    star_price = float(repo.get_setting('star_price'))
     
     text = f"Получатель: <code>@{data.get('recipient')}</code>\n\n<b>Выберите пакет звёзд для подарка:</b>"
     kb = user_kb.get_star_packs_kb(page, "buy_stars_gift", star_price, user["discount"], back_target="back_to_gift_choice")
     await safe_edit_message(call, text=text, reply_markup=kb)
 
 @router.callback_query(F.data.startswith("buy_stars_gift_pack_"))
-async def buy_stars_gift_pack_selected(call: types.CallbackQuery, state: FSMContext, repo: Repository):
+async def buy_stars_gift_pack_selected(call: types.CallbackQuery, state: FSMContext, repo: Repository, fragment_sender: FragmentSender):
+    data = await state.get_data()
+    recipient = data.get("recipient")
+    if not recipient:
+        await call.answer("Получатель не указан, начните покупку подарка заново.", show_alert=True)
+        return
+
     amount = int(call.data.split("_")[-1])
-    star_price = float(await repo.get_setting('star_price'))
+    star_price = float(repo.get_setting('star_price'))
     total = round(amount * star_price, 2)
     user = await repo.get_user(call.from_user.id)
-    data = await state.get_data()
-    recipient = data.get("recipient")
     discount = user["discount"]
 
     if discount:
@@ -210,9 +250,10 @@ async def buy_stars_gift_pack_selected(call: types.CallbackQuery, state: FSMCont
     kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="✅ Подтвердить", callback_data="buy_stars_gift_confirm")], [types.InlineKeyboardButton(text="⬅️ Назад", callback_data="buy_stars_gift_packs")]])
     await safe_edit_message(call, text=f"{price_text}\n\nПодтвердить покупку?", reply_markup=kb)
     await state.set_state(BuyStarsConfirmStates.waiting_for_gift_confirm)
+    fragment_sender.prefetch(call.from_user.id, "stars", recipient, amount)
 
 @router.message(BuyStarsGiftStates.waiting_for_gift_amount)
-async def process_gift_amount(message: types.Message, state: FSMContext, repo: Repository):
+async def process_gift_amount(message: types.Message, state: FSMContext, repo: Repository, fragment_sender: FragmentSender):
     try:
         amount = int(message.text)
         if amount < 50:
@@ -222,7 +263,7 @@ async def process_gift_amount(message: types.Message, state: FSMContext, repo: R
         await message.answer("❗ Введите целое число.")
         return
 
-    star_price = float(await repo.get_setting('star_price'))
+    star_price = float(repo.get_setting('star_price'))
     total = round(amount * star_price, 2)
     data = await state.get_data()
     recipient = data.get("recipient")
@@ -240,37 +281,48 @@ async def process_gift_amount(message: types.Message, state: FSMContext, repo: R
     kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="✅ Подтвердить", callback_data="buy_stars_gift_confirm")], [types.InlineKeyboardButton(text="⬅️ Назад", callback_data="buy_stars_gift_amount")]])
     await message.answer(f"{price_text}\n\nПодтвердить покупку?", reply_markup=kb)
     await state.set_state(BuyStarsConfirmStates.waiting_for_gift_confirm)
+    fragment_sender.prefetch(message.from_user.id, "stars", recipient, amount)
 
 @router.callback_query(BuyStarsConfirmStates.waiting_for_gift_confirm, F.data == "buy_stars_gift_confirm")
-async def buy_stars_gift_confirm_callback(call: types.CallbackQuery, state: FSMContext, repo: Repository, fragment_sender: FragmentSender):
+async def buy_stars_gift_confirm_callback(call: types.CallbackQuery, state: FSMContext, repo: Repository, fulfillment: FulfillmentQueue, fragment_sender: FragmentSender):
     data = await state.get_data()
     amount, total, recipient = data.get("amount"), data.get("total"), data.get("recipient")
     user_obj = call.from_user
-    user_db = await repo.get_user(user_obj.id)
 
-    if float(user_db["balance"]) < total:
+    if not fragment_sender.is_available():
+        error_kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]])
+        await safe_edit_message(call, text="⚠️ Fragment временно не отвечает. Попробуйте через пару минут, средства не списаны.", reply_markup=error_kb)
+        await state.clear()
+        return
+
+    profit_calc = ProfitCalculator()
+    cost_ton, profit_rub = await profit_calc.calculate_stars_profit(amount, total)
+
+    reservation = await fragment_sender.reserve(cost_ton)
+    if reservation is None:
+        error_kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]])
+        await safe_edit_message(call, text="⚠️ Покупка временно недоступна. Попробуйте позже, средства не списаны.", reply_markup=error_kb)
+        await state.clear()
+        return
+
+    try:
+        hold_id = await repo.hold(user_obj.id, total)
+    except Exception:
+        reservation.wallet.release(reservation)
+        raise
+    if hold_id is None:
+        reservation.wallet.release(reservation)
+        user_db = await repo.get_user(user_obj.id)
         error_message = f"Недостаточно средств! Не хватает: <b>{total - float(user_db['balance'])}₽</b>"
         error_kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="💰 Пополнить баланс", callback_data="profile_topup")]])
         await safe_edit_message(call, text=error_message, reply_markup=error_kb)
         await state.clear()
         return
-        
-    profit_calc = ProfitCalculator()
-    cost_ton, profit_rub = await profit_calc.calculate_stars_profit(amount, total)
-    
-    success_text_template = await repo.get_setting('purchase_success_text')
-    success_text = format_text_with_user_data(success_text_template, user_obj)
-    
-    await repo.update_user_balance(user_obj.id, total, operation='sub')
-    
-    success = await fragment_sender.send_stars(recipient, amount)
-    
-    if success:
-        await repo.update_user_discount(user_obj.id, None) 
-        await repo.add_purchase_to_history(user_obj.id, 'stars', f'{amount} Stars for @{recipient}', amount, total, profit_rub)
-        final_message = f"{success_text}\n\nПодарок для <code>@{recipient}</code> на <b>{amount} звёзд</b> успешно отправлен!"
-        await safe_edit_message(call, text=final_message, reply_markup=None)
-        
+
+    try:
+        success_text_template = repo.get_setting('purchase_success_text')
+        success_text = format_text_with_user_data(success_text_template, user_obj)
+
         profit_text = (
             f"🎁 <b>Новый подарок звёзд</b>\n\n"
             f"👤 Покупатель: @{call.from_user.username}\n"
@@ -280,11 +332,31 @@ async def buy_stars_gift_confirm_callback(call: types.CallbackQuery, state: FSMC
             f"📈 Прибыль: {profit_rub:.2f}₽\n"
             f"📊 Маржа: {profit_calc.get_profit_margin(total - profit_rub, total):.1f}%"
         )
-        await fragment_sender._notify_admins(profit_text)
-    else:
-        await repo.update_user_balance(user_obj.id, total, operation='add')
-        error_kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]])
-        await safe_edit_message(call, text="❌ Произошла ошибка при отправке звёзд. Средства возвращены на ваш баланс. Обратитесь в поддержку.", reply_markup=error_kb)
+
+        await call.answer()
+        await safe_edit_message(call, text=f"⏳ Заказ принят в обработку. Подарок для <code>@{recipient}</code> будет отправлен в ближайшее время.", reply_markup=None)
+        await fulfillment.submit(FulfillmentOrder(
+            user_id=user_obj.id,
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            is_photo=bool(call.message.photo),
+            product='stars',
+            recipient=recipient,
+            quantity=amount,
+            total=total,
+            profit=profit_rub,
+            history_description=f'{amount} Stars for @{recipient}',
+            success_text=f"{success_text}\n\nПодарок для <code>@{recipient}</code> на <b>{amount} звёзд</b> успешно отправлен!",
+            failure_text="❌ Произошла ошибка при отправке звёзд. Средства возвращены на ваш баланс. Обратитесь в поддержку.",
+            admin_text=profit_text,
+            hold_id=hold_id,
+            reservation=reservation,
+        ))
+    except Exception:
+        # Nothing reached the fulfillment queue, so give back both the hold and the TON reservation.
+        await repo.release(hold_id)
+        reservation.wallet.release(reservation)
+        raise
     await state.clear()
 
 @router.callback_query(F.data == "back_to_gift_choice")
@@ -16,7 +16,7 @@ def format_text_with_user_data(text: str, user: types.User) -> str:
     return text.replace('{ID}', str(user.id)).replace('{@username}', username).replace('{full_name}', user.full_name)
 
 async def show_main_menu(message: types.Message, repo: Repository, config: Config, user: types.User):
-    settings = await repo.get_multiple_settings(['start_text', 'support_contact', 'news_channel_link'])
+    settings = repo.get_multiple_settings(['start_text', 'support_contact', 'news_channel_link'])
     start_text_template = settings.get('start_text', 'Добро пожаловать!')
     support_contact = settings.get('support_contact')
     news_channel_link = settings.get('news_channel_link')
@@ -44,7 +44,7 @@ async def main_menu_callback(call: types.CallbackQuery, repo: Repository, config
 
 @router.callback_query(SubscribeCallback.filter(F.action == "check"))
 async def check_subscription_handler(call: types.CallbackQuery, bot: Bot, repo: Repository, config: Config):
-    settings = await repo.get_multiple_settings(['news_channel_id', 'news_channel_link'])
+    settings = repo.get_multiple_settings(['news_channel_id', 'news_channel_link'])
     channel_id = settings.get('news_channel_id')
     
     if not channel_id:
@@ -19,6 +19,9 @@ PREMIUM_PLANS = [
 class SubscribeCallback(CallbackData, prefix="sub"):
     action: str
 
+class HistoryCallback(CallbackData, prefix="history"):
+    page: int
+
 def get_main_menu_kb(config: Config, user_id: int, support_contact: str, news_channel_link: str) -> InlineKeyboardMarkup:
     buttons = [
         [
@@ -53,11 +56,26 @@ def get_profile_kb() -> InlineKeyboardMarkup:
             InlineKeyboardButton(text="💰 Пополнить баланс", callback_data="profile_topup_menu"),
             InlineKeyboardButton(text="🎟️ Промокоды", callback_data="profile_activate_promo")
         ],
+        [
+            InlineKeyboardButton(text="🧾 История пополнений и покупок", callback_data=HistoryCallback(page=1).pack())
+        ],
         [
             InlineKeyboardButton(text="⬅️ Назад", callback_data="main_menu")
         ]
     ])
 
+def get_history_kb(page: int, max_page: int) -> InlineKeyboardMarkup:
+    nav_row = []
+    if page > 1:
+        nav_row.append(InlineKeyboardButton(text="⬅️", callback_data=HistoryCallback(page=page-1).pack()))
+    nav_row.append(InlineKeyboardButton(text=f"{page}/{max_page}", callback_data="ignore"))
+    if page < max_page:
+        nav_row.append(InlineKeyboardButton(text="➡️", callback_data=HistoryCallback(page=page+1).pack()))
+    return InlineKeyboardMarkup(inline_keyboard=[
+        nav_row,
+        [InlineKeyboardButton(text="⬅️ Назад в профиль", callback_data="profile")]
+    ])
+
 def get_payment_method_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="💎 CryptoBot", callback_data="topup_cryptobot")],
@@ -2,29 +2,28 @@ import asyncio
 import json
 import logging
 import sys
-import shutil
 import os
-from datetime import datetime, timedelta
 
 import pytz
 from aiohttp import web
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
-from aiogram.types import FSInputFile
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 from config import Config, load_config
-from database import init_db, get_db_connection
+from database import init_db, Database
 from handlers.user import get_user_router
 from handlers.admin import get_admin_router
-from middlewares.access import AccessMiddleware
+from middlewares.access import AccessMiddleware, UserScopeMiddleware
 from services.repository import Repository
 from services.fragment_sender import FragmentSender
 from services.fragment_auth import FragmentAuth
+from services.fulfillment import FulfillmentQueue
+from services.backup import send_backup
+from services.payment_monitor import PaymentMonitor
 from payments.cryptobot import check_cryptopay_signature
+from payments.crystalpay import check_crystalpay_signature
 from payments.payment_manager import PaymentManager
-from payments.lolzteam import check_lzt_payment_status
-from payments.crystalpay import check_crystalpay_invoice
 
 
 async def cryptopay_webhook(request: web.Request):
@@ -70,86 +69,41 @@ async def cryptopay_webhook(request: web.Request):
             
     return web.Response(status=200, text="OK")
 
-async def monitor_payments(bot: Bot, repo: Repository, config: Config):
-    logging.info("Payment monitor started.")
-    while True:
-        try:
-            pending_payments = await repo.get_all_pending_payments()
-            
-            for payment in pending_payments:
-                order_id = payment['uuid']
-                user_id = payment['user_id']
-                message_id = payment['message_id']
-                created_at = datetime.fromisoformat(payment['created_at'])
-
-                if datetime.utcnow() > created_at + timedelta(seconds=config.payment_timeout_seconds):
-                    status_was_updated = await repo.update_payment_status(order_id, 'expired')
-                    if status_was_updated:
-                        logging.info(f"Payment {order_id} for user {user_id} has expired. Status updated.")
-                        try:
-                            await bot.edit_message_text(
-                                chat_id=user_id, 
-                                message_id=message_id, 
-                                text="❌ Время оплаты истекло. Счет был отменен.",
-                                reply_markup=None
-                            )
-                        except Exception:
-                            pass
-                    continue
-
-                payment_system = payment['payment_system']
-                if payment_system in ['lzt', 'crystalpay']:
-                    is_paid = False
-                    if payment_system == 'lzt':
-                        is_paid, _ = await check_lzt_payment_status(config, order_id)
-                    elif payment_system == 'crystalpay':
-                        invoice_id = payment['external_invoice_id']
-                        if invoice_id:
-                            is_paid, _ = await check_crystalpay_invoice(config, invoice_id)
-
-                    if is_paid:
-                        payment_info = await repo.process_successful_payment(order_id)
-                        if payment_info:
-                            logging.info(f"Successfully processed {payment_system} payment for order_id {order_id}.")
-                            try:
-                                user = await repo.get_user(payment_info['user_id'])
-                                await bot.edit_message_text(
-                                    chat_id=payment_info["user_id"],
-                                    message_id=payment_info["message_id"],
-                                    text=f"✅ Платеж успешно выполнен!\n\n💰 Сумма: {payment_info['amount']:.2f}₽\n💳 Ваш новый баланс: {user['balance']:.2f}₽",
-                                    reply_markup=None
-                                )
-                            except Exception as e:
-                                logging.error(f"Monitor: Failed to edit notification for user {payment_info['user_id']}: {e}")
-        
-        except Exception as e:
-            logging.error(f"Error in payment monitor: {e}")
-        
-        await asyncio.sleep(20)
+async def crystalpay_webhook(request: web.Request):
+    repo: Repository = request.app["repo"]
+    config: Config = request.app["config"]
+    payment_monitor: PaymentMonitor = request.app["payment_monitor"]
 
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        logging.error("CrystalPay Webhook: Invalid JSON received.")
+        return web.Response(status=400, text="Invalid JSON")
+
+    invoice_id = data.get("id")
+    if not check_crystalpay_signature(config, invoice_id, data.get("signature")):
+        logging.warning("CrystalPay Webhook: Invalid signature received.")
+        return web.Response(status=403, text="Invalid signature")
+
+    if data.get("state") not in ('payed', 'paid') or not (order_id := data.get("extra")):
+        return web.Response(status=200, text="OK")
+
+    # The signature covers only the invoice id, so the order must belong to that invoice.
+    payment = await repo.get_payment(order_id)
+    if not payment or payment['payment_system'] != 'crystalpay' or str(payment['external_invoice_id']) != str(invoice_id):
+        logging.warning(f"CrystalPay Webhook: Invoice {invoice_id} does not match order {order_id}.")
+        return web.Response(status=200, text="OK")
+
+    await payment_monitor.credit(order_id, 'crystalpay')
+    return web.Response(status=200, text="OK")
 
 async def backup_database(bot: Bot, config: Config):
     if not os.path.exists(config.database_path):
         return
 
-    timestamp = datetime.now(pytz.timezone('Europe/Moscow')).strftime("%Y-%m-%d_%H-%M-%S")
-    backup_path = f"backup_{timestamp}.db"
-    
-    try:
-        shutil.copy(config.database_path, backup_path)
-        document = FSInputFile(backup_path)
-        caption = f"Ежедневный бэкап базы данных\n{timestamp} МСК"
-        
-        for admin_id in config.admin_ids:
-            try:
-                await bot.send_document(chat_id=admin_id, document=document, caption=caption)
-            except Exception as e:
-                logging.error(f"Failed to send backup to admin {admin_id}: {e}")
-    except Exception as e:
-        logging.error(f"Failed to create or send database backup: {e}")
-    finally:
-        if os.path.exists(backup_path):
-            os.remove(backup_path)
+    await send_backup(bot, config, config.admin_ids, "Ежедневный бэкап базы данных")
 
 async def start_bot():
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
@@ -182,18 +136,32 @@ async def start_bot():
     bot = Bot(token=config.bot_token, default=DefaultBotProperties(parse_mode="HTML"))
     dp = Dispatcher()
     
-    db_connection = await get_db_connection(config.database_path)
     await init_db(config.database_path)
+    database = await Database.open(
+        config.database_path, config.db_readers,
+        config.db_group_commit_window,
+    )
     
-    repo = Repository(db_connection)
+    repo = Repository(database, config.user_cache_size, config.user_cache_ttl)
+    await repo.load_settings()
+    await repo.load_blocked_users()
     fragment_sender = FragmentSender(config, bot)
+    await fragment_sender.start()
+    fulfillment = FulfillmentQueue(config, bot, repo, fragment_sender)
+    fulfillment.start()
+    await fulfillment.report_open_holds()
     payment_manager = PaymentManager(config)
+    payment_monitor = PaymentMonitor(config, bot, repo)
+    await payment_monitor.start()
 
     dp["repo"] = repo
     dp["config"] = config
     dp["fragment_sender"] = fragment_sender
+    dp["fulfillment"] = fulfillment
     dp["payment_manager"] = payment_manager
+    dp["payment_monitor"] = payment_monitor
 
+    dp.update.outer_middleware(UserScopeMiddleware(repo))
     dp.update.outer_middleware(AccessMiddleware(repo, config))
 
     admin_router = get_admin_router(config.admin_ids)
@@ -205,7 +173,9 @@ async def start_bot():
     app["bot"] = bot
     app["repo"] = repo
     app["config"] = config
+    app["payment_monitor"] = payment_monitor
     app.router.add_post("/webhook/cryptopay", cryptopay_webhook)
+    app.router.add_post("/webhook/crystalpay", crystalpay_webhook)
     
     fragment_auth = FragmentAuth(config)
     
@@ -215,24 +185,27 @@ async def start_bot():
     scheduler = AsyncIOScheduler(timezone=pytz.timezone('Europe/Moscow'))
     scheduler.add_job(backup_database, 'cron', hour=0, minute=0, kwargs={'bot': bot, 'config': config})
     scheduler.add_job(refresh_fragment_token, 'interval', hours=1)
+    scheduler.add_job(fragment_sender.sync_balances, 'interval', seconds=config.ton_balance_sync_seconds)
+    if config.settings_poll_seconds > 0:
+        scheduler.add_job(repo.reload_if_changed, 'interval', seconds=config.settings_poll_seconds)
     scheduler.start()
     
     runner = web.AppRunner(app)
     await runner.setup()
     site = web.TCPSite(runner, "0.0.0.0", 8080)
     
-    monitor_task = asyncio.create_task(monitor_payments(bot, repo, config))
-    
     try:
         await asyncio.gather(
             dp.start_polling(bot),
             site.start()
         )
     finally:
-        monitor_task.cancel()
+        await payment_monitor.stop()
+        await fulfillment.stop()
+        await fragment_sender.close()
         await bot.session.close()
         await runner.cleanup()
-        await db_connection.close()
+        await database.close()
 
 if __name__ == "__main__":
     try:
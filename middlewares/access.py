@@ -1,4 +1,5 @@
 import logging
+import time
 from typing import Callable, Dict, Any, Awaitable
 from aiogram import Bot, types
 from aiogram.dispatcher.middlewares.base import BaseMiddleware
@@ -7,10 +8,27 @@ from aiogram.types import TelegramObject
 from config import Config
 from services.repository import Repository
 
+class UserScopeMiddleware(BaseMiddleware):
+    def __init__(self, repo: Repository):
+        self.repo = repo
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        with self.repo.user_scope():
+            return await handler(event, data)
+
+# Minimum pause between maintenance notices sent to the same user, seconds.
+MAINTENANCE_REPLY_INTERVAL = 30
+
 class AccessMiddleware(BaseMiddleware):
     def __init__(self, repo: Repository, config: Config):
         self.repo = repo
         self.config = config
+        self._maintenance_replies: Dict[int, float] = {}
 
     async def __call__(
         self,
@@ -25,17 +43,34 @@ class AccessMiddleware(BaseMiddleware):
         if user.id in self.config.admin_ids:
             return await handler(event, data)
 
-        settings = await self.repo.get_multiple_settings(['maintenance_mode'])
-
-        if settings.get('maintenance_mode') == '1':
-            if isinstance(event, types.Message):
+        if self.repo.get_setting('maintenance_mode') == '1':
+            # Registered as an update middleware, so the message or callback is nested in the update.
+            if isinstance(event, types.Update):
+                event = event.message or event.callback_query or event
+            # Only the visible notice is rate-limited; callbacks are always answered to stop the button spinner.
+            should_reply = self._should_reply_maintenance(user.id)
+            if isinstance(event, types.Message) and should_reply:
                 await event.answer("🛠️ Бот находится на техническом обслуживании. Пожалуйста, попробуйте позже.")
             elif isinstance(event, types.CallbackQuery):
-                await event.answer("🛠️ Бот находится на техническом обслуживании.", show_alert=True)
+                if should_reply:
+                    await event.answer("🛠️ Бот находится на техническом обслуживании.", show_alert=True)
+                else:
+                    await event.answer()
             return
 
-        is_blocked = await self.repo.is_user_blocked(user.id)
-        if is_blocked:
+        if self.repo.is_user_blocked(user.id):
             return
 
-        return await handler(event, data)
\ No newline at end of file
+        return await handler(event, data)
+
+    def _should_reply_maintenance(self, user_id: int) -> bool:
+        now = time.monotonic()
+        if now - self._maintenance_replies.get(user_id, float('-inf')) < MAINTENANCE_REPLY_INTERVAL:
+            return False
+        if len(self._maintenance_replies) > 10000:
+            self._maintenance_replies = {
+                uid: sent_at for uid, sent_at in self._maintenance_replies.items()
+                if now - sent_at < MAINTENANCE_REPLY_INTERVAL
+            }
+        self._maintenance_replies[user_id] = now
+        return True
\ No newline at end of file
@@ -41,7 +41,7 @@ class CheckSubscriptionFilter(Filter):
         if user.id in config.admin_ids:
             return True
 
-        settings = await repo.get_multiple_settings(['force_subscribe', 'news_channel_id', 'news_channel_link'])
+        settings = repo.get_multiple_settings(['force_subscribe', 'news_channel_id', 'news_channel_link'])
 
         if settings.get('force_subscribe') != '1':
             return True
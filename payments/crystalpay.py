@@ -1,3 +1,6 @@
+import hashlib
+import hmac
+
 import httpx
 from config import Config
 
@@ -11,6 +14,8 @@ async def create_crystalpay_invoice(config: Config, amount: float, order_id: str
         "lifetime": config.payment_timeout_seconds // 60,
         "extra": order_id
     }
+    if config.crystalpay_callback_url:
+        data["callback_url"] = config.crystalpay_callback_url
     
     try:
         async with httpx.AsyncClient() as client:
@@ -23,7 +28,8 @@ async def create_crystalpay_invoice(config: Config, amount: float, order_id: str
         return None, None
     return None, None
 
-async def check_crystalpay_invoice(config: Config, invoice_id: str) -> tuple[bool, float]:
+async def check_crystalpay_invoice(config: Config, invoice_id: str, client: httpx.AsyncClient) -> tuple[bool, float]:
+    # Transport and API errors propagate so the payment monitor can count them.
     headers = {'Content-Type': 'application/json'}
     data = {
         "auth_login": config.crystalpay_login,
@@ -31,15 +37,20 @@ async def check_crystalpay_invoice(config: Config, invoice_id: str) -> tuple[boo
         "id": invoice_id
     }
     
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{config.crystalpay_api_url}/invoice/status/", headers=headers, json=data)
-            if response.status_code == 200:
-                result = response.json()
-                if not result.get('error'):
-                    state = result.get('state', '')
-                    amount = float(result.get('amount', 0))
-                    return state in ['payed', 'paid'], amount
-    except Exception:
-        return False, 0
-    return False, 0
\ No newline at end of file
+    response = await client.post(f"{config.crystalpay_api_url}/invoice/status/", headers=headers, json=data)
+    response.raise_for_status()
+    result = response.json()
+    if result.get('error'):
+        raise RuntimeError(f"CrystalPay error: {result.get('errors') or result.get('error')}")
+    state = result.get('state', '')
+    amount = float(result.get('amount', 0))
+    return state in ['payed', 'paid'], amount
+
+def check_crystalpay_signature(config: Config, invoice_id: str, signature: str) -> bool:
+    # CrystalPay signs callbacks with sha1 of "<invoice id>:<salt>".
+    salt = config.crystalpay_salt
+    if not salt or not invoice_id or not signature:
+        return False
+
+    calculated_signature = hashlib.sha1(f"{invoice_id}:{salt}".encode('utf-8')).hexdigest()
+    return hmac.compare_digest(calculated_signature, str(signature))
@@ -1,40 +1,112 @@
+import logging
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
 import httpx
 from config import Config
+from services.metrics import metrics
+
+LZT_PAYMENTS_URL = 'https://prod-api.lzt.market/user/payments'
+# Upper bound on pages walked per refresh, so a long gap cannot turn one cycle into a crawl.
+LZT_MAX_PAGES = 10
+# Operations older than the payment timeout plus this margin can no longer match a pending order.
+LZT_INDEX_GRACE_SECONDS = 600
+
+
+def _iter_payments(data: Any) -> Iterator[dict]:
+    payments_data = data.get('payments') if isinstance(data, dict) else None
+    if isinstance(payments_data, dict):
+        payments_data = payments_data.values()
+    if not payments_data:
+        return
+    for payment in payments_data:
+        if isinstance(payment, dict):
+            yield payment
+
+
+class LztPaymentIndex:
+    # Incoming LZT transfers indexed by comment; each refresh only fetches operations newer than the watermark.
+    def __init__(self, config: Config):
+        self.config = config
+        self.last_operation_id = 0
+        # Ranges left unwalked when a refresh hit the page cap: operations with floor < id < before, newest first.
+        self.gaps: List[Tuple[int, int]] = []
+        self._by_comment: Dict[str, Tuple[float, float]] = {}
+
+    async def refresh(self, client: httpx.AsyncClient) -> None:
+        cutoff = time.time() - self.config.payment_timeout_seconds - LZT_INDEX_GRACE_SECONDS
+        pages, newest, stopped_at = await self._walk(client, None, self.last_operation_id, cutoff, LZT_MAX_PAGES)
+        if stopped_at is not None:
+            self.gaps.insert(0, (stopped_at, self.last_operation_id))
+        # Only advanced after the walk, so a failed refresh is retried from the same point.
+        self.last_operation_id = newest
+
+        while self.gaps and pages < LZT_MAX_PAGES:
+            before, floor = self.gaps[0]
+            walked, _, stopped_at = await self._walk(client, before, floor, cutoff, LZT_MAX_PAGES - pages)
+            pages += walked
+            if stopped_at is None:
+                self.gaps.pop(0)
+            else:
+                self.gaps[0] = (stopped_at, floor)
+        if self.gaps:
+            logging.warning(f"LZT refresh stopped after {pages} pages, {len(self.gaps)} range(s) left for the next refresh")
+
+        self._prune(cutoff)
+        metrics.observe("lzt.refresh_pages", pages)
+        metrics.set("lzt.indexed_payments", len(self._by_comment))
+        metrics.set("lzt.unwalked_ranges", len(self.gaps))
+
+    async def _walk(self, client: httpx.AsyncClient, before: Optional[int], floor: int, cutoff: float, max_pages: int) -> Tuple[int, int, Optional[int]]:
+        # Walks down from before (or the newest operation) to floor; returns the pages fetched, the newest id seen
+        # and, when max_pages ran out first, the operation_id_lt to resume from.
+        headers = {
+            'accept': 'application/json',
+            'authorization': f'Bearer {self.config.lzt_token}'
+        }
+        params: Dict[str, Any] = {'type': 'receiving_money'}
+        if before is not None:
+            params['operation_id_lt'] = before
+        newest = floor
+        pages = 0
+
+        while pages < max_pages:
+            response = await client.get(LZT_PAYMENTS_URL, headers=headers, params=params)
+            response.raise_for_status()
+            pages += 1
+
+            operation_ids = []
+            reached_known = False
+            for payment in _iter_payments(response.json()):
+                operation_id = int(payment.get('operation_id') or 0)
+                operation_ids.append(operation_id)
+                if operation_id <= floor or float(payment.get('operation_date') or 0) < cutoff:
+                    reached_known = True
+                    continue
+                newest = max(newest, operation_id)
+                self._add(payment)
+
+            if reached_known or not operation_ids:
+                return pages, newest, None
+            params['operation_id_lt'] = min(operation_ids)
+        return pages, newest, params['operation_id_lt']
+
+    def _add(self, payment: dict):
+        payment_data = payment.get('data')
+        comment = payment_data.get('comment') if isinstance(payment_data, dict) else None
+        if not comment:
+            return
+        if payment.get('operation_type') == 'receiving_money' and payment.get('payment_status') == 'success_in':
+            self._by_comment[comment] = (float(payment.get('incoming_sum') or 0), float(payment.get('operation_date') or time.time()))
+
+    def _prune(self, cutoff: float):
+        self._by_comment = {comment: entry for comment, entry in self._by_comment.items() if entry[1] >= cutoff}
 
-async def check_lzt_payment_status(config: Config, order_id: str) -> tuple[bool, float]:
-    headers = {
-        'accept': 'application/json',
-        'authorization': f'Bearer {config.lzt_token}'
-    }
-    
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get('https://prod-api.lzt.market/user/payments', headers=headers)
-
-        if response.status_code == 200:
-            data = response.json()
-            if 'payments' in data:
-                payments_data = data['payments']
-                
-                if isinstance(payments_data, dict):
-                    for _, payment in payments_data.items():
-                        if isinstance(payment, dict):
-                            payment_data_inner = payment.get('data', {})
-                            if isinstance(payment_data_inner, dict) and payment_data_inner.get('comment') == order_id:
-                                if payment.get('operation_type') == 'receiving_money' and payment.get('payment_status') == 'success_in':
-                                    return True, float(payment.get('incoming_sum', '0.00'))
-                                
-                elif isinstance(payments_data, list):
-                    for payment in payments_data:
-                         if isinstance(payment, dict):
-                            payment_data_inner = payment.get('data', {})
-                            if isinstance(payment_data_inner, dict) and payment_data_inner.get('comment') == order_id:
-                                if payment.get('operation_type') == 'receiving_money' and payment.get('payment_status') == 'success_in':
-                                    return True, float(payment.get('incoming_sum', '0.00'))
-
-        return False, 0
-    except Exception:
-        return False, 0
+    def find(self, order_id: str) -> tuple[bool, float]:
+        entry = self._by_comment.get(order_id)
+        if entry is None:
+            return False, 0
+        return True, entry[0]
 
 def create_lzt_payment_link(config: Config, amount: float, order_id: str) -> str:
-    return f"https://lzt.market/balance/transfer?user_id={config.lzt_user_id}&hold=0&amount={amount}&comment={order_id}"
\ No newline at end of file
+    return f"https://lzt.market/balance/transfer?user_id={config.lzt_user_id}&hold=0&amount={amount}&comment={order_id}"
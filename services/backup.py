@@ -0,0 +1,141 @@
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterable, List
+
+import pytz
+from aiogram import Bot
+from aiogram.types import FSInputFile
+
+from config import Config
+from .metrics import metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Pages copied per backup step; between steps the source is unlocked so writers can proceed.
+BACKUP_PAGES_PER_STEP = 1024
+# Telegram bots can upload documents of up to 50 MB.
+PART_SIZE = 49 * 1024 * 1024
+
+
+@dataclass
+class BackupResult:
+    parts: List[str]
+    codec: str
+    raw_size: int
+    size: int
+    duration: float
+
+
+def _format_size(size: int) -> str:
+    for unit in ("Б", "КБ", "МБ"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГБ"
+
+
+def _compress(source_path: str, codec: str) -> str:
+    if codec == "zstd":
+        target_path = f"{source_path}.zst"
+        with open(source_path, "rb") as src, open(target_path, "wb") as dst:
+            zstandard.ZstdCompressor(level=10, threads=-1).copy_stream(src, dst)
+    elif codec == "gzip":
+        target_path = f"{source_path}.gz"
+        with open(source_path, "rb") as src, gzip.open(target_path, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+    else:
+        return source_path
+    os.remove(source_path)
+    return target_path
+
+
+def _split(path: str) -> List[str]:
+    if os.path.getsize(path) <= PART_SIZE:
+        return [path]
+    parts = []
+    with open(path, "rb") as src:
+        while chunk := src.read(PART_SIZE):
+            part_path = f"{path}.part{len(parts) + 1:03d}"
+            with open(part_path, "wb") as dst:
+                dst.write(chunk)
+            parts.append(part_path)
+    os.remove(path)
+    return parts
+
+
+def create_backup(database_path: str, target_dir: str, name: str, codec: str) -> BackupResult:
+    # Blocking: run it in a worker thread.
+    started = time.monotonic()
+    snapshot_path = os.path.join(target_dir, f"{name}.db")
+
+    source = sqlite3.connect(database_path)
+    target = sqlite3.connect(snapshot_path)
+    try:
+        source.backup(target, pages=BACKUP_PAGES_PER_STEP, sleep=0.005)
+    finally:
+        target.close()
+        source.close()
+
+    raw_size = os.path.getsize(snapshot_path)
+    compressed_path = _compress(snapshot_path, codec)
+    size = os.path.getsize(compressed_path)
+    parts = _split(compressed_path)
+    return BackupResult(parts, codec, raw_size, size, time.monotonic() - started)
+
+
+def _resolve_codec(codec: str) -> str:
+    if codec == "zstd" and zstandard is None:
+        logging.warning("zstandard is not installed, falling back to gzip for backups")
+        return "gzip"
+    return codec if codec in ("zstd", "gzip") else "none"
+
+
+async def send_backup(bot: Bot, config: Config, chat_ids: Iterable[int], title: str, prefix: str = "backup") -> bool:
+    timestamp = datetime.now(pytz.timezone('Europe/Moscow')).strftime("%Y-%m-%d_%H-%M-%S")
+    target_dir = tempfile.mkdtemp(prefix="db_backup_")
+    try:
+        result = await asyncio.to_thread(
+            create_backup, config.database_path, target_dir, f"{prefix}_{timestamp}",
+            _resolve_codec(config.backup_compression),
+        )
+        metrics.observe("backup.seconds", result.duration)
+        metrics.set("backup.bytes", result.size)
+        logging.info(f"Database backup created in {result.duration:.1f}s: {result.raw_size} -> {result.size} bytes, {len(result.parts)} part(s)")
+
+        caption = (
+            f"{title}\n🕐 {timestamp} МСК\n"
+            f"⏱ {result.duration:.1f} с · 💾 {_format_size(result.size)}"
+        )
+        if result.codec != "none":
+            caption += f" ({result.codec}, исходно {_format_size(result.raw_size)})"
+
+        sent = False
+        for chat_id in chat_ids:
+            for index, part in enumerate(result.parts, start=1):
+                part_caption = caption
+                if len(result.parts) > 1:
+                    joined = os.path.basename(part).rsplit(".part", 1)[0]
+                    part_caption += f"\n📦 Часть {index}/{len(result.parts)}, склеить: cat {joined}.part* > {joined}"
+                try:
+                    await bot.send_document(chat_id=chat_id, document=FSInputFile(part), caption=part_caption)
+                    sent = True
+                except Exception as e:
+                    logging.error(f"Failed to send backup part {index} to {chat_id}: {e}")
+        return sent
+    except Exception as e:
+        logging.error(f"Failed to create or send database backup: {e}")
+        metrics.inc("backup.failed")
+        return False
+    finally:
+        shutil.rmtree(target_dir, ignore_errors=True)
@@ -0,0 +1,91 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from .metrics import metrics
+
+
+class DeadlineScheduler:
+    # Min-heap of wall-clock deadlines; one task sleeps until the earliest and runs the callback for each due key.
+    # Rescheduled and cancelled keys leave stale heap entries behind, skipped when they surface.
+    def __init__(self, name: str, callback: Callable[[Hashable, Any], Awaitable[None]]):
+        self.name = name
+        self.callback = callback
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._entries: Dict[Hashable, Tuple[float, int, Any]] = {}
+        self._counter = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def deadline(self, key: Hashable) -> Optional[float]:
+        entry = self._entries.get(key)
+        return entry[0] if entry else None
+
+    def payload(self, key: Hashable) -> Any:
+        entry = self._entries.get(key)
+        return entry[2] if entry else None
+
+    def schedule(self, key: Hashable, deadline: float, payload: Any = None):
+        self._counter += 1
+        self._entries[key] = (deadline, self._counter, payload)
+        heapq.heappush(self._heap, (deadline, self._counter, key))
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [(entry[0], entry[1], k) for k, entry in self._entries.items()]
+            heapq.heapify(self._heap)
+        if self._heap[0][1] == self._counter:
+            self._wakeup.set()
+        metrics.set(f"{self.name}.scheduled", len(self._entries))
+
+    def cancel(self, key: Hashable):
+        if self._entries.pop(key, None) is not None:
+            metrics.set(f"{self.name}.scheduled", len(self._entries))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        tasks = list(self._running)
+        if self._task is not None:
+            tasks.append(self._task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            self._fire_due()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _fire_due(self):
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            deadline, counter, key = heapq.heappop(self._heap)
+            entry = self._entries.get(key)
+            if entry is None or entry[1] != counter:
+                continue
+            del self._entries[key]
+            metrics.observe(f"{self.name}.lateness_seconds", now - deadline)
+            task = asyncio.create_task(self._fire(key, entry[2]))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+        metrics.set(f"{self.name}.scheduled", len(self._entries))
+
+    async def _fire(self, key: Hashable, payload: Any):
+        try:
+            await self.callback(key, payload)
+        except Exception as e:
+            logging.error(f"{self.name}: callback for {key} failed: {e}")
@@ -49,7 +49,7 @@ class FragmentAuth:
 
     async def refresh_token_if_needed(self, repo: Repository) -> bool:
         try:
-            token_expires = await repo.get_setting('fragment_token_expires_at')
+            token_expires = repo.get_setting('fragment_token_expires_at')
             if not token_expires:
                 return await self._refresh_token(repo)
             
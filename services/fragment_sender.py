@@ -1,21 +1,82 @@
+import asyncio
 import base64
 import re
 import logging
+import time
+import aiohttp
 import httpx
 import traceback
 import json
+from dataclasses import dataclass
+from typing import Awaitable, Dict, List, Tuple, TypeVar
 from aiogram import Bot
 from tonutils.client import TonapiClient
 from tonutils.wallet import WalletV4R2
+from tonutils.wallet.messages import TransferMessage
 from config import Config
+from .cache import TTLCache
+from .metrics import metrics
+from .resilience import AdaptiveLimiter, CircuitBreaker
+from .ton_wallet import HotWallet, Reservation
 from .ton_api import get_ton_balance
 
+T = TypeVar("T")
+
 def fix_base64_padding(b64_string: str) -> str:
     missing_padding = len(b64_string) % 4
     if missing_padding:
         b64_string += '=' * (4 - missing_padding)
     return b64_string
 
+class FragmentAPIError(Exception):
+    pass
+
+class FragmentUnavailableError(Exception):
+    pass
+
+@dataclass(frozen=True)
+class FragmentStep:
+    method: str
+    referer: str
+    fields: Tuple[str, ...]
+
+@dataclass(frozen=True)
+class FragmentProduct:
+    name: str
+    title: str
+    quantity_field: str
+    search: FragmentStep
+    init: FragmentStep
+    link: FragmentStep
+    comment_template: str
+
+PRODUCTS: Dict[str, FragmentProduct] = {
+    "stars": FragmentProduct(
+        name="stars",
+        title="звёзд",
+        quantity_field="quantity",
+        search=FragmentStep("searchStarsRecipient", "https://fragment.com/stars", ("query",)),
+        init=FragmentStep("initBuyStarsRequest", "https://fragment.com/stars/buy?query={query}", ("recipient", "quantity")),
+        link=FragmentStep("getBuyStarsLink", "https://fragment.com/stars/buy?recipient={recipient}&quantity={quantity}", ("id",)),
+        comment_template=r"{quantity} Telegram Stars.*",
+    ),
+    "premium": FragmentProduct(
+        name="premium",
+        title="премиума",
+        quantity_field="months",
+        search=FragmentStep("searchPremiumGiftRecipient", "https://fragment.com/premium", ("query", "months")),
+        init=FragmentStep("initGiftPremiumRequest", "https://fragment.com/premium/gift?query={query}", ("recipient", "months")),
+        link=FragmentStep("getGiftPremiumLink", "https://fragment.com/premium/gift?recipient={recipient}&months={months}", ("id",)),
+        comment_template=r"Telegram.*Ref\s*#\S+",
+    ),
+}
+
+@dataclass
+class Prefetch:
+    params: Tuple[str, str, int]
+    task: asyncio.Task
+    expiry: asyncio.TimerHandle | None = None
+
 class FragmentSender:
     def __init__(self, config: Config, bot: Bot):
         self.config = config
@@ -30,54 +91,187 @@ class FragmentSender:
             "User-Agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 16_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/16.6 Mobile/15E148 Safari/604.1",
             "X-Requested-With": "XMLHttpRequest",
         }
+        self.client: httpx.AsyncClient | None = None
+        self.ton_client: TonapiClient | None = None
+        self.wallets: List[HotWallet] = []
+        self._wallet_lock = asyncio.Lock()
+        self._low_balance_notified_at = 0.0
+        self._prefetches: Dict[int, Prefetch] = {}
+        self.limiter = AdaptiveLimiter(
+            "fragment.limiter",
+            min_limit=1,
+            max_limit=self.config.fragment_pool_size,
+            target_latency=self.config.fragment_target_latency,
+        )
+        self.breaker = CircuitBreaker(
+            "fragment.breaker",
+            failure_threshold=self.config.fragment_breaker_threshold,
+            reset_timeout=self.config.fragment_breaker_reset,
+            on_state_change=self._on_breaker_state_change,
+        )
+        self.recipients = TTLCache(
+            "fragment_recipients",
+            maxsize=self.config.recipient_cache_size,
+            ttl=self.config.recipient_cache_ttl,
+            negative_ttl=self.config.recipient_negative_ttl,
+        )
         logging.info("FragmentSender initialized")
 
-    async def _send_ton_transaction(self, recipient_addr, amount, payload, comment_template):
+    async def start(self):
+        if self.client is not None:
+            return
+
+        self.client = httpx.AsyncClient(
+            http2=self.config.fragment_http2,
+            cookies=self.config.fragment_cookies,
+            headers=self.base_headers,
+            timeout=30.0,
+            limits=httpx.Limits(
+                max_connections=self.config.fragment_pool_size,
+                max_keepalive_connections=self.config.fragment_pool_keepalive,
+                keepalive_expiry=self.config.fragment_keepalive_expiry,
+            ),
+        )
+
+        try:
+            response = await self.client.get("https://fragment.com/stars")
+            logging.info(f"Fragment connection pre-warmed ({response.http_version}, HTTP {response.status_code})")
+        except httpx.HTTPError as e:
+            logging.warning(f"Failed to pre-warm Fragment connection: {e}")
+
         try:
+            await self._get_wallets()
+            await self.sync_balances()
+        except Exception as e:
+            logging.error(f"Failed to initialize wallet pool: {e}")
+
+    async def close(self):
+        for user_id in list(self._prefetches):
+            self._discard_prefetch(user_id)
+        await asyncio.gather(*[hot.close() for hot in self.wallets])
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+            logging.info("FragmentSender HTTP client closed")
+        if self.ton_client is not None:
+            await self.ton_client.close_session()
+            self.ton_client = None
+            self.wallets = []
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        if self.client is None:
+            await self.start()
+        return self.client
+
+    async def _get_wallets(self) -> List[HotWallet]:
+        if self.wallets:
+            return self.wallets
+
+        async with self._wallet_lock:
+            if self.wallets:
+                return self.wallets
+
             if not self.config.api_ton:
                 logging.critical("API_TON is not set in .env file!")
-                return False
-            
-            client = TonapiClient(api_key=self.config.api_ton, is_testnet=False)
-            
-            if not self.config.wallet_seed:
+                raise RuntimeError("API_TON is not set")
+            if not self.config.wallet_seeds:
                 logging.critical("WALLET_SEED is not set in .env file!")
-                return False
-                
-            wallet, _, _, _ = WalletV4R2.from_mnemonic(client, self.config.wallet_seed.split())
-            sender_address = wallet.address
-            logging.info(f"Wallet loaded successfully: {sender_address}")
+                raise RuntimeError("WALLET_SEED is not set")
 
-        except Exception as e:
-            logging.error(f"Failed to initialize wallet: {e}")
-            return False
+            session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+            ton_client = TonapiClient(api_key=self.config.api_ton, is_testnet=False, session=session)
 
-        amount_decimal = float(amount) / 1_000_000_000
-        current_balance, balance_error = await get_ton_balance(str(sender_address))
+            started = time.monotonic()
+            try:
+                # PBKDF2 key derivation is CPU-bound, keep it off the event loop.
+                derived = await asyncio.gather(*[
+                    asyncio.to_thread(WalletV4R2.from_mnemonic, ton_client, seed.split())
+                    for seed in self.config.wallet_seeds
+                ])
+            except Exception:
+                await session.close()
+                raise
+            elapsed = time.monotonic() - started
+            metrics.set("ton.wallet_derivation_seconds", elapsed)
 
-        if balance_error:
-            logging.error(f"Could not check TON wallet balance: {balance_error}")
-            return False
-        
-        if current_balance < amount_decimal:
-            logging.critical(f"Insufficient funds. Required: {amount_decimal:.4f} TON, Available: {current_balance:.4f} TON.")
-            error_text = (
-                f"<b>⚠️ Недостаточно средств на кошельке!</b>\n\n"
-                f"Не удалось совершить покупку.\n"
-                f"<b>Требуется:</b> <code>{amount_decimal:.4f} TON</code>\n"
-                f"<b>В наличии:</b> <code>{current_balance:.4f} TON</code>\n\n"
-                f"Пожалуйста, пополните кошелек: <code>{sender_address}</code>"
-            )
-            for admin_id in self.config.admin_ids:
-                try:
-                    await self.bot.send_message(admin_id, error_text)
-                except Exception as e:
-                    logging.error(f"Failed to send low balance notification to admin {admin_id}: {e}")
-            return False
-        
+            self.ton_client = ton_client
+            self.wallets = [
+                HotWallet(index, self.config, ton_client, wallet, public_key)
+                for index, (wallet, public_key, _, _) in enumerate(derived)
+            ]
+            for hot in self.wallets:
+                logging.info(f"Wallet {hot.index} loaded successfully: {hot.address}")
+            logging.info(f"Wallet pool of {len(self.wallets)} derived in {elapsed * 1000:.0f} ms")
+            return self.wallets
+
+    async def sync_balances(self):
+        for hot in self.wallets:
+            balance, error = await get_ton_balance(hot.address.to_str())
+            if error:
+                logging.warning(f"Failed to sync balance of {hot.name}: {error}")
+                continue
+            hot.sync(round(balance * 1_000_000_000))
+
+    async def reserve(self, cost_ton: float) -> Reservation | None:
+        wallets = await self._get_wallets()
+        amount_nano = round(cost_ton * 1_000_000_000)
+
+        # No awaits past this point: picking a wallet and reserving on it is atomic for the event loop.
+        funded = [hot for hot in wallets if hot.available_nano is None or hot.available_nano >= amount_nano]
+        for hot in sorted(funded, key=lambda w: (w.in_flight, -(w.available_nano or 0))):
+            reservation = hot.reserve(amount_nano)
+            if reservation is not None:
+                return reservation
+
+        metrics.inc("ton.reservation_rejected")
+        available = max((hot.available_nano or 0 for hot in wallets), default=0)
+        asyncio.create_task(self._notify_low_balance(amount_nano, available, wallets[0]))
+        return None
+
+    async def _notify_low_balance(self, required_nano: int, available_nano: int, hot: HotWallet):
+        if time.monotonic() - self._low_balance_notified_at < 600:
+            return
+        self._low_balance_notified_at = time.monotonic()
+
+        logging.critical(f"Insufficient funds. Required: {required_nano / 1_000_000_000:.4f} TON, Available: {available_nano / 1_000_000_000:.4f} TON.")
+        error_text = (
+            f"<b>⚠️ Недостаточно средств на кошельке!</b>\n\n"
+            f"Не удалось совершить покупку.\n"
+            f"<b>Требуется:</b> <code>{required_nano / 1_000_000_000:.4f} TON</code>\n"
+            f"<b>В наличии:</b> <code>{available_nano / 1_000_000_000:.4f} TON</code>\n\n"
+            f"Пожалуйста, пополните кошелек: <code>{hot.address.to_str()}</code>"
+        )
+        for admin_id in self.config.admin_ids:
+            try:
+                await self.bot.send_message(admin_id, error_text)
+            except Exception as e:
+                logging.error(f"Failed to send low balance notification to admin {admin_id}: {e}")
+
+    def _wallet_step3_fields(self, hot: HotWallet) -> dict:
+        # The primary wallet keeps the TonConnect data copied from fragment.com.
+        if hot.index == 0 and self.config.fragment_address:
+            return {
+                "address": self.config.fragment_address,
+                "walletStateInit": self.config.fragment_wallets,
+                "publicKey": self.config.fragment_public_key,
+            }
+        return {
+            "address": hot.raw_address,
+            "walletStateInit": hot.state_init,
+            "publicKey": hot.public_key,
+        }
+
+    async def _send_ton_transaction(self, reservation: Reservation, recipient_addr, amount, payload, comment_template):
         if not recipient_addr or not amount or not payload:
             logging.error("Transaction failed: Missing recipient, amount, or payload.")
             return False
+
+        hot = reservation.wallet
+        amount_nano = int(amount)
+        if not hot.resize(reservation, amount_nano):
+            logging.error(f"Not enough unreserved TON on {hot.name} for {amount_nano / 1_000_000_000:.4f} TON transfer")
+            await self._notify_low_balance(amount_nano, hot.available_nano or 0, hot)
+            return False
         
         try:
             decoded_bytes = base64.b64decode(fix_base64_padding(payload))
@@ -88,111 +282,239 @@ class FragmentSender:
             final_text = match.group(0) if match else clean_text
             logging.info(f"Transaction body: {final_text}")
             
-            tx_hash = await wallet.transfer(
-                destination=recipient_addr,
-                amount=amount_decimal,
-                body=final_text,
-            )
-            logging.info(f"Transaction sent successfully: {tx_hash}")
+            message = TransferMessage(destination=recipient_addr, amount=amount_nano / 1_000_000_000, body=final_text)
+            tx_hash = await hot.submit(message, reservation)
+            logging.info(f"Transaction sent successfully from {hot.name}: {tx_hash}")
             return True
             
         except Exception as e:
             logging.error(f"TON transaction failed: {e}")
             return False
 
-    async def send_stars(self, username: str, quantity: int) -> bool:
-        logging.info(f"Starting stars purchase: {quantity} stars for @{username}")
+    async def _run_step(self, product: FragmentProduct, step: str, coro: Awaitable[T]) -> T:
+        started = time.monotonic()
+        outcome = "error"
+        try:
+            result = await coro
+            outcome = "ok" if result else "failed"
+            return result
+        finally:
+            metrics.observe(f"fragment.{product.name}.{step}.{outcome}", time.monotonic() - started)
+
+    def is_available(self) -> bool:
+        return self.breaker.state != CircuitBreaker.OPEN
+
+    def _on_breaker_state_change(self, old_state: str, new_state: str):
+        # Half-open probes come and go while Fragment is down, admins only hear about outages and recoveries.
+        if new_state == CircuitBreaker.OPEN and old_state == CircuitBreaker.CLOSED:
+            message = (
+                f"🔴 Fragment API недоступен: {self.breaker.failures} ошибок подряд.\n"
+                f"Новые заказы временно не принимаются, повторная проверка через {self.config.fragment_breaker_reset:.0f} с."
+            )
+        elif new_state == CircuitBreaker.CLOSED:
+            message = "🟢 Fragment API снова отвечает, приём заказов возобновлён."
+        else:
+            return
+        asyncio.create_task(self._notify_admins(message))
+
+    async def _post_step(self, client: httpx.AsyncClient, step: FragmentStep, context: dict, extra: dict | None = None) -> dict:
+        headers = self.base_headers.copy()
+        headers["Referer"] = step.referer.format(**context)
+        data = {field: context[field] for field in step.fields}
+        data.update(extra or {})
+        data["method"] = step.method
+
+        if not self.breaker.allow():
+            raise FragmentUnavailableError("Fragment API circuit breaker is open")
+
+        try:
+            async with self.limiter.acquire():
+                response = await client.post(self.url, data=data, headers=headers)
+                response.raise_for_status()
+                json_response = response.json()
+        except asyncio.CancelledError:
+            self.breaker.record_cancelled()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return json_response
+
+    async def _search(self, client: httpx.AsyncClient, product: FragmentProduct, context: dict, notify: bool) -> str | None:
+        async def lookup() -> str | None:
+            json_response = await self._post_step(client, product.search, context)
+            if not json_response.get("ok", True):
+                raise FragmentAPIError(f"Fragment API error in {product.name} search: {json_response.get('error')}")
+            return json_response.get("found", {}).get("recipient") or None
+
+        recipient = await self.recipients.get_or_load((product.name, context["query"].lower()), lookup)
+        if not recipient:
+            logging.error(f"{product.name} recipient not found for username: {context['query']}")
+            if notify:
+                await self._notify_admins(f"❌ Пользователь @{context['query']} не найден на Fragment")
+        return recipient
+
+    async def _init(self, client: httpx.AsyncClient, product: FragmentProduct, context: dict, notify: bool) -> str | None:
+        json_response = await self._post_step(client, product.init, context)
+
+        if not json_response.get("ok", True):
+            logging.error(f"Fragment API error in {product.name} init: {json_response.get('error')}")
+            # A stale cached recipient would keep failing here, look it up again next time.
+            self.recipients.invalidate((product.name, context["query"].lower()))
+            if notify:
+                await self._notify_admins(f"❌ Ошибка инициализации покупки {product.title}: {json_response.get('error')}")
+            return None
+
+        req_id = json_response.get("req_id")
+        if not req_id:
+            logging.error(f"Failed to get {product.name} req_id: {json_response.get('error')}")
+        return req_id
+
+    async def _link(self, client: httpx.AsyncClient, product: FragmentProduct, context: dict, hot: HotWallet) -> dict | None:
+        extra = {
+            **self._wallet_step3_fields(hot),
+            "chain": "-239",
+            "features": ["SendTransaction", {"name": "SendTransaction", "maxMessages": 255}],
+            "maxProtocolVersion": 2,
+            "platform": "iphone",
+            "appName": "Tonkeeper",
+            "appVersion": "5.0.14",
+            "transaction": "1",
+            "show_sender": "0",
+        }
+        json_response = await self._post_step(client, product.link, context, extra)
+
+        if not (json_response.get("ok") and "transaction" in json_response):
+            error_msg = json_response.get("error", "Unknown error")
+            logging.error(f"Failed to get {product.name} transaction data from Fragment: {error_msg}")
+            await self._notify_admins(f"❌ Ошибка получения данных транзакции {product.title}: {error_msg}")
+            return None
+
+        return json_response["transaction"]["messages"][0]
+
+    async def _prepare(self, client: httpx.AsyncClient, product: FragmentProduct, username: str, quantity: int, notify: bool = True) -> Tuple[str, str] | None:
+        context = {"query": username, product.quantity_field: quantity}
+
+        recipient = await self._run_step(product, "search", self._search(client, product, context, notify))
+        if not recipient:
+            return None
+        context["recipient"] = recipient
+
+        req_id = await self._run_step(product, "init", self._init(client, product, context, notify))
+        if not req_id:
+            return None
+
+        return recipient, req_id
+
+    def prefetch(self, user_id: int, kind: str, username: str, quantity: int):
+        # Runs search and init while the user is still looking at the confirmation screen.
+        self._discard_prefetch(user_id)
+        if not username:
+            return
+        task = asyncio.create_task(self._run_prefetch(PRODUCTS[kind], username, quantity))
+        prefetch = Prefetch((kind, username.lower(), quantity), task)
+        prefetch.expiry = asyncio.get_running_loop().call_later(
+            self.config.prefetch_ttl, self._expire_prefetch, user_id, prefetch
+        )
+        self._prefetches[user_id] = prefetch
+        metrics.inc("fragment.prefetch.started")
+
+    async def _run_prefetch(self, product: FragmentProduct, username: str, quantity: int) -> Tuple[str, str] | None:
+        try:
+            client = await self._get_client()
+            return await self._prepare(client, product, username, quantity, notify=False)
+        except Exception as e:
+            logging.warning(f"Fragment prefetch for @{username} failed: {e}")
+            return None
+
+    def _expire_prefetch(self, user_id: int, prefetch: Prefetch):
+        if self._prefetches.get(user_id) is prefetch:
+            self._discard_prefetch(user_id)
+            metrics.inc("fragment.prefetch.expired")
+
+    def _discard_prefetch(self, user_id: int):
+        prefetch = self._prefetches.pop(user_id, None)
+        if prefetch is None:
+            return
+        prefetch.task.cancel()
+        if prefetch.expiry is not None:
+            prefetch.expiry.cancel()
+
+    async def _take_prefetch(self, user_id: int | None, kind: str, username: str, quantity: int) -> Tuple[str, str] | None:
+        if user_id is None or not username:
+            return None
+
+        prefetch = self._prefetches.pop(user_id, None)
+        if prefetch is None:
+            metrics.inc("fragment.prefetch.miss")
+            return None
+        prefetch.expiry.cancel()
+        if prefetch.params != (kind, username.lower(), quantity):
+            prefetch.task.cancel()
+            metrics.inc("fragment.prefetch.miss")
+            return None
+
+        prepared = await prefetch.task
+        metrics.inc("fragment.prefetch.hit" if prepared else "fragment.prefetch.failed")
+        return prepared
+
+    async def send(self, product: FragmentProduct, username: str, quantity: int, reservation: Reservation | None = None, prefetch_key: int | None = None) -> bool:
+        logging.info(f"Starting {product.name} purchase: {quantity} for @{username}")
         
         try:
-            async with httpx.AsyncClient(
-                cookies=self.config.fragment_cookies, 
-                headers=self.base_headers,
-                timeout=30.0
-            ) as client:
-                
-                headers_step1 = self.base_headers.copy()
-                headers_step1["Referer"] = "https://fragment.com/stars"
-                data_step1 = {"query": username, "method": "searchStarsRecipient"}
-                
-                response_step1 = await client.post(self.url, data=data_step1, headers=headers_step1)
-                response_step1.raise_for_status()
-                json_step1 = response_step1.json()
-                
-                if not json_step1.get("ok", True):
-                    logging.error(f"Fragment API error in step 1: {json_step1.get('error')}")
-                    return False
-                
-                recipient = json_step1.get("found", {}).get("recipient")
-                if not recipient:
-                    logging.error(f"Recipient not found for username: {username}")
-                    await self._notify_admins(f"❌ Пользователь @{username} не найден на Fragment")
-                    return False
+            client = await self._get_client()
 
-                headers_step2 = self.base_headers.copy()
-                headers_step2["Referer"] = f"https://fragment.com/stars/buy?query={username}"
-                data_step2 = {"recipient": recipient, "quantity": quantity, "method": "initBuyStarsRequest"}
-
-                response_step2 = await client.post(self.url, data=data_step2, headers=headers_step2)
-                response_step2.raise_for_status()
-                json_step2 = response_step2.json()
-                
-                if not json_step2.get("ok", True):
-                    logging.error(f"Fragment API error in step 2: {json_step2.get('error')}")
-                    await self._notify_admins(f"❌ Ошибка инициализации покупки звёзд: {json_step2.get('error')}")
-                    return False
-                
-                req_id = json_step2.get("req_id")
-                if not req_id:
-                    logging.error(f"Failed to get req_id: {json_step2.get('error')}")
-                    return False
-                
-                headers_step3 = self.base_headers.copy()
-                headers_step3["Referer"] = f"https://fragment.com/stars/buy?recipient={recipient}&quantity={quantity}"
-                data_step3 = {
-                    "address": self.config.fragment_address,
-                    "chain": "-239",
-                    "walletStateInit": self.config.fragment_wallets,
-                    "publicKey": self.config.fragment_public_key,
-                    "features": ["SendTransaction", {"name": "SendTransaction", "maxMessages": 255}],
-                    "maxProtocolVersion": 2,
-                    "platform": "iphone",
-                    "appName": "Tonkeeper",
-                    "appVersion": "5.0.14",
-                    "transaction": "1",
-                    "id": req_id,
-                    "show_sender": "0",
-                    "method": "getBuyStarsLink"
-                }
-
-                response_step3 = await client.post(self.url, data=data_step3, headers=headers_step3)
-                response_step3.raise_for_status()
-                json_step3 = response_step3.json()
-
-                if not (json_step3.get("ok") and "transaction" in json_step3):
-                    error_msg = json_step3.get("error", "Unknown error")
-                    logging.error(f"Failed to get transaction data from Fragment: {error_msg}")
-                    await self._notify_admins(f"❌ Ошибка получения данных транзакции: {error_msg}")
+            prepared = await self._take_prefetch(prefetch_key, product.name, username, quantity)
+            if prepared is None:
+                prepared = await self._prepare(client, product, username, quantity)
+            if prepared is None:
+                return False
+            recipient, req_id = prepared
+
+            if reservation is None:
+                reservation = await self.reserve(0)
+                if reservation is None:
                     return False
-                
-                tx = json_step3["transaction"]["messages"][0]
-                addr, amount, payload = tx["address"], tx["amount"], tx["payload"]
-
-                comment_template = rf"{quantity} Telegram Stars.*"
-                success = await self._send_ton_transaction(addr, amount, payload, comment_template)
-                
-                if success:
-                    logging.info(f"Successfully sent {quantity} stars to @{username}")
-                
-                return success
 
+            context = {"query": username, product.quantity_field: quantity, "recipient": recipient, "id": req_id}
+            tx = await self._run_step(product, "link", self._link(client, product, context, reservation.wallet))
+            if not tx:
+                return False
+
+            comment_template = product.comment_template.format(quantity=quantity)
+            success = await self._run_step(product, "transfer", self._send_ton_transaction(
+                reservation, tx["address"], tx["amount"], tx["payload"], comment_template
+            ))
+            
+            if success:
+                logging.info(f"Successfully sent {quantity} {product.name} to @{username}")
+            
+            return success
+
+        except (FragmentAPIError, FragmentUnavailableError) as e:
+            logging.error(str(e))
+            return False
         except httpx.HTTPStatusError as e:
-            logging.error(f"HTTP error during stars purchase for @{username}: {e.response.status_code}")
-            await self._notify_admins(f"❌ HTTP ошибка при покупке звёзд для @{username}: {e.response.status_code}")
+            # Availability problems reach admins through the circuit breaker alert instead of once per order.
+            logging.error(f"HTTP error during {product.name} purchase for @{username}: {e.response.status_code}")
+            return False
+        except httpx.TransportError as e:
+            logging.error(f"Fragment request failed during {product.name} purchase for @{username}: {e!r}")
             return False
         except Exception as e:
-            logging.error(f"Stars purchase failed for @{username}: {e}")
-            await self._notify_admins(f"❌ Ошибка покупки звёзд для @{username}: {str(e)}")
+            logging.error(f"{product.name} purchase failed for @{username}: {e}")
+            await self._notify_admins(f"❌ Ошибка покупки {product.title} для @{username}: {str(e)}")
             return False
+        finally:
+            if reservation is not None:
+                reservation.wallet.release(reservation)
+
+    async def send_stars(self, username: str, quantity: int, reservation: Reservation | None = None, prefetch_key: int | None = None) -> bool:
+        return await self.send(PRODUCTS["stars"], username, quantity, reservation, prefetch_key)
+
+    async def send_premium(self, username: str, months: int, reservation: Reservation | None = None, prefetch_key: int | None = None) -> bool:
+        return await self.send(PRODUCTS["premium"], username, months, reservation, prefetch_key)
 
     async def _notify_admins(self, message: str):
         for admin_id in self.config.admin_ids:
@@ -200,98 +522,3 @@ class FragmentSender:
                 await self.bot.send_message(admin_id, f"🔗 <b>Fragment уведомление</b>\n\n{message}")
             except Exception as e:
                 logging.error(f"Failed to notify admin {admin_id}: {e}")
-
-    async def send_premium(self, username: str, months: int) -> bool:
-        logging.info(f"Starting premium purchase: {months} months for @{username}")
-        
-        try:
-            async with httpx.AsyncClient(
-                cookies=self.config.fragment_cookies, 
-                headers=self.base_headers,
-                timeout=30.0
-            ) as client:
-                
-                headers_step1 = self.base_headers.copy()
-                headers_step1["Referer"] = "https://fragment.com/premium"
-                data_step1 = {"query": username, "months": months, "method": "searchPremiumGiftRecipient"}
-                
-                response_step1 = await client.post(self.url, data=data_step1, headers=headers_step1)
-                response_step1.raise_for_status()
-                json_step1 = response_step1.json()
-                
-                if not json_step1.get("ok", True):
-                    logging.error(f"Fragment API error in premium step 1: {json_step1.get('error')}")
-                    return False
-                
-                recipient = json_step1.get("found", {}).get("recipient")
-                if not recipient:
-                    logging.error(f"Premium recipient not found for username: {username}")
-                    await self._notify_admins(f"❌ Пользователь @{username} не найден для премиума")
-                    return False
-                
-                headers_step2 = self.base_headers.copy()
-                headers_step2["Referer"] = f"https://fragment.com/premium/gift?query={username}"
-                data_step2 = {"recipient": recipient, "months": months, "method": "initGiftPremiumRequest"}
-
-                response_step2 = await client.post(self.url, data=data_step2, headers=headers_step2)
-                response_step2.raise_for_status()
-                json_step2 = response_step2.json()
-                
-                if not json_step2.get("ok", True):
-                    logging.error(f"Fragment API error in premium step 2: {json_step2.get('error')}")
-                    await self._notify_admins(f"❌ Ошибка инициализации покупки премиума: {json_step2.get('error')}")
-                    return False
-                
-                req_id = json_step2.get("req_id")
-                if not req_id:
-                    logging.error(f"Failed to get premium req_id: {json_step2.get('error')}")
-                    return False
-                
-                headers_step3 = self.base_headers.copy()
-                headers_step3["Referer"] = f"https://fragment.com/premium/gift?recipient={recipient}&months={months}"
-                data_step3 = {
-                    "address": self.config.fragment_address,
-                    "chain": "-239",
-                    "walletStateInit": self.config.fragment_wallets,
-                    "publicKey": self.config.fragment_public_key,
-                    "features": ["SendTransaction", {"name": "SendTransaction", "maxMessages": 255}],
-                    "maxProtocolVersion": 2,
-                    "platform": "iphone",
-                    "appName": "Tonkeeper",
-                    "appVersion": "5.0.14",
-                    "transaction": "1",
-                    "id": req_id,
-                    "show_sender": "0",
-                    "method": "getGiftPremiumLink"
-                }
-
-                response_step3 = await client.post(self.url, data=data_step3, headers=headers_step3)
-                response_step3.raise_for_status()
-                json_step3 = response_step3.json()
-
-                if not (json_step3.get("ok") and "transaction" in json_step3):
-                    error_msg = json_step3.get("error", "Unknown error")
-                    logging.error(f"Failed to get premium transaction data from Fragment: {error_msg}")
-                    await self._notify_admins(f"❌ Ошибка получения данных транзакции премиума: {error_msg}")
-                    return False
-
-                tx = json_step3["transaction"]["messages"][0]
-                addr, amount, payload = tx["address"], tx["amount"], tx["payload"]
-                
-                comment_template = r"Telegram.*Ref\s*#\S+"
-                success = await self._send_ton_transaction(addr, amount, payload, comment_template)
-                
-                if success:
-                    logging.info(f"Successfully sent {months} months premium to @{username}")
-                
-                return success
-
-        except httpx.HTTPStatusError as e:
-            logging.error(f"HTTP error during premium purchase for @{username}: {e.response.status_code}")
-            await self._notify_admins(f"❌ HTTP ошибка при покупке премиума для @{username}: {e.response.status_code}")
-            return False
-        except Exception as e:
-            logging.error(f"Premium purchase failed for @{username}: {e}")
-            await self._notify_admins(f"❌ Ошибка покупки премиума для @{username}: {str(e)}")
-
-            return False
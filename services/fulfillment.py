@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramBadRequest
+
+from config import Config
+from services.fragment_sender import PRODUCTS, FragmentSender
+from services.metrics import metrics
+from services.repository import Repository
+from services.ton_wallet import Reservation
+
+@dataclass
+class FulfillmentOrder:
+    user_id: int
+    chat_id: int
+    message_id: int
+    is_photo: bool
+    product: str
+    recipient: str
+    quantity: int
+    total: float
+    profit: float
+    history_description: str
+    success_text: str
+    failure_text: str
+    admin_text: str
+    hold_id: int
+    reservation: Optional[Reservation] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class FulfillmentQueue:
+    def __init__(self, config: Config, bot: Bot, repo: Repository, fragment_sender: FragmentSender):
+        self.config = config
+        self.bot = bot
+        self.repo = repo
+        self.fragment_sender = fragment_sender
+        self.queue: asyncio.Queue[FulfillmentOrder] = asyncio.Queue()
+        self.workers: List[asyncio.Task] = []
+        self.started_at: Optional[float] = None
+
+    def start(self):
+        self.started_at = time.monotonic()
+        for worker_id in range(self.config.fulfillment_workers):
+            self.workers.append(asyncio.create_task(self._worker(worker_id)))
+        logging.info(f"Fulfillment queue started with {len(self.workers)} workers")
+
+    async def report_open_holds(self):
+        # Holds that survive a restart belong to orders whose outcome is unknown: the transfer may or may not have gone out.
+        holds = await self.repo.get_open_holds()
+        if not holds:
+            return
+        logging.warning(f"{len(holds)} balance holds were left open by the previous run")
+        lines = "\n".join(f"• #{hold['id']}: пользователь <code>{hold['user_id']}</code>, {hold['amount']:.2f}₽, {hold['created_at']}" for hold in holds[:20])
+        text = f"<b>⚠️ Незавершённые заказы после перезапуска: {len(holds)}</b>\n\nСредства заблокированы, проверьте выдачу вручную:\n{lines}"
+        for admin_id in self.config.admin_ids:
+            try:
+                await self.bot.send_message(admin_id, text)
+            except Exception as e:
+                logging.error(f"Failed to notify admin {admin_id} about open holds: {e}")
+
+    async def stop(self, timeout: float = 60.0):
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Fulfillment queue did not drain in {timeout:.0f}s, {self.queue.qsize()} orders left")
+
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers.clear()
+
+        while not self.queue.empty():
+            order = self.queue.get_nowait()
+            await self._refund(order)
+            self.queue.task_done()
+
+    async def submit(self, order: FulfillmentOrder) -> int:
+        await self.queue.put(order)
+        depth = self.queue.qsize()
+        metrics.set("fulfillment.queue_depth", depth)
+        metrics.inc("fulfillment.submitted")
+        return depth
+
+    async def _worker(self, worker_id: int):
+        while True:
+            order = await self.queue.get()
+            metrics.set("fulfillment.queue_depth", self.queue.qsize())
+            metrics.observe("fulfillment.wait_seconds", time.monotonic() - order.enqueued_at)
+            try:
+                with metrics.timer("fulfillment.process_seconds"):
+                    await self._process(order)
+            except Exception as e:
+                logging.error(f"Fulfillment worker {worker_id} failed to process order for user {order.user_id}: {e}")
+            finally:
+                self.queue.task_done()
+                metrics.inc(f"fulfillment.worker_{worker_id}.completed")
+                uptime_minutes = max((time.monotonic() - self.started_at) / 60, 1 / 60)
+                metrics.set(
+                    f"fulfillment.worker_{worker_id}.orders_per_min",
+                    metrics.counters[f"fulfillment.worker_{worker_id}.completed"] / uptime_minutes
+                )
+
+    async def _process(self, order: FulfillmentOrder):
+        product = PRODUCTS.get(order.product)
+        if product is None:
+            logging.error(f"Fulfillment: unknown product '{order.product}' in order for user {order.user_id}")
+            await self._refund(order)
+            return
+
+        success = await self.fragment_sender.send(product, order.recipient, order.quantity, order.reservation, prefetch_key=order.user_id)
+        if not success:
+            await self._refund(order)
+            return
+
+        metrics.inc(f"fulfillment.{order.product}.succeeded")
+        await self.repo.capture(order.hold_id, order.product, order.history_description, order.quantity, order.profit)
+        await self._edit_message(order, order.success_text)
+        await self.fragment_sender._notify_admins(order.admin_text)
+
+    async def _refund(self, order: FulfillmentOrder):
+        metrics.inc(f"fulfillment.{order.product}.failed")
+        if order.reservation is not None:
+            order.reservation.wallet.release(order.reservation)
+        await self.repo.release(order.hold_id)
+        error_kb = types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]])
+        await self._edit_message(order, order.failure_text, error_kb)
+
+    async def _edit_message(self, order: FulfillmentOrder, text: str, reply_markup: types.InlineKeyboardMarkup = None):
+        try:
+            if order.is_photo:
+                await self.bot.edit_message_caption(chat_id=order.chat_id, message_id=order.message_id, caption=text, reply_markup=reply_markup)
+            else:
+                await self.bot.edit_message_text(text=text, chat_id=order.chat_id, message_id=order.message_id, reply_markup=reply_markup)
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return
+            logging.warning(f"Failed to edit order message, sending a new one. Error: {e}")
+            try:
+                await self.bot.send_message(order.chat_id, text, reply_markup=reply_markup)
+            except Exception as e:
+                logging.error(f"Failed to notify user {order.user_id} about order result: {e}")
+        except Exception as e:
+            logging.error(f"Failed to notify user {order.user_id} about order result: {e}")
@@ -0,0 +1,85 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List
+
+class Histogram:
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.bucket_counts = [0] * (len(self.BUCKETS) + 1)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for i, bound in enumerate(self.BUCKETS):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                return
+        self.bucket_counts[-1] += 1
+
+    @property
+    def avg(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.bucket_counts):
+            seen += bucket_count
+            if seen >= target:
+                return min(self.BUCKETS[i], self.max) if i < len(self.BUCKETS) else self.max
+        return self.max
+
+
+class Metrics:
+    def __init__(self):
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.gauges: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = defaultdict(Histogram)
+
+    def inc(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def set(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        self.histograms[name].observe(value)
+
+    @contextmanager
+    def timer(self, name: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started)
+
+    def format_report(self, prefix: str = "") -> str:
+        lines: List[str] = []
+        for name in sorted(self.gauges):
+            if name.startswith(prefix):
+                lines.append(f"{name} = {self.gauges[name]:.3f}")
+        for name in sorted(self.counters):
+            if name.startswith(prefix):
+                lines.append(f"{name} = {self.counters[name]}")
+        for name in sorted(self.histograms):
+            if name.startswith(prefix):
+                h = self.histograms[name]
+                unit = "s" if name.endswith("seconds") or name.startswith("fragment.") else ""
+                lines.append(
+                    f"{name}: n={h.count} avg={h.avg:.3f}{unit} p50≤{h.percentile(0.5):.3f}{unit} "
+                    f"p95≤{h.percentile(0.95):.3f}{unit} max={h.max or 0:.3f}{unit}"
+                )
+        return "\n".join(lines)
+
+
+metrics = Metrics()
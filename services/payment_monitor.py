@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import httpx
+from aiogram import Bot
+
+from config import Config
+from payments.crystalpay import check_crystalpay_invoice
+from payments.lolzteam import LztPaymentIndex
+from .deadlines import DeadlineScheduler
+from .metrics import metrics
+from .repository import Repository
+
+# Per provider: poll interval while the invoice is fresh, how long it counts as fresh, and the backoff cap, seconds.
+POLL_SCHEDULES = {
+    'crystalpay': (3, 120, 60),
+    'lzt': (5, 120, 60),
+}
+# With CrystalPay callbacks configured, polling is only a fallback for lost callbacks.
+CRYSTALPAY_FALLBACK_SCHEDULE = (30, 120, 120)
+# Minimum pause between checks of one invoice requested with the "check payment" button, seconds.
+MANUAL_CHECK_COOLDOWN = 3
+
+
+def _created_timestamp(payment) -> float:
+    return datetime.fromisoformat(payment['created_at']).replace(tzinfo=timezone.utc).timestamp()
+
+
+class PaymentMonitor:
+    def __init__(self, config: Config, bot: Bot, repo: Repository):
+        self.config = config
+        self.bot = bot
+        self.repo = repo
+        self.client = httpx.AsyncClient(
+            timeout=15,
+            limits=httpx.Limits(
+                max_connections=config.crystalpay_check_concurrency + 2,
+                max_keepalive_connections=config.crystalpay_check_concurrency + 2,
+            ),
+        )
+        self.lzt_index = LztPaymentIndex(config)
+        self._limits: Dict[str, asyncio.Semaphore] = {
+            'crystalpay': asyncio.Semaphore(config.crystalpay_check_concurrency),
+        }
+        self._lzt_refresh: Optional[asyncio.Task] = None
+        self._lzt_refreshed_at = 0.0
+        self._last_checked: Dict[str, float] = {}
+        self.poll_schedules = dict(POLL_SCHEDULES)
+        if config.crystalpay_callback_url:
+            self.poll_schedules['crystalpay'] = CRYSTALPAY_FALLBACK_SCHEDULE
+        # Every pending payment has an expiry deadline; polled providers also have a next-check time.
+        self.expiry = DeadlineScheduler("payment_expiry", self._expire)
+        self.checks = DeadlineScheduler("payment_checks", self._poll)
+        repo.add_payment_listener(self.track)
+
+    async def start(self):
+        for payment in await self.repo.get_all_pending_payments():
+            self.track(payment)
+        self.expiry.start()
+        self.checks.start()
+        logging.info(f"Payment monitor started with {len(self.expiry)} pending payments.")
+
+    async def stop(self):
+        await self.checks.stop()
+        await self.expiry.stop()
+        await self.client.aclose()
+
+    def track(self, payment):
+        order_id = payment['uuid']
+        self.expiry.schedule(order_id, _created_timestamp(payment) + self.config.payment_timeout_seconds, payment)
+        if payment['payment_system'] in self.poll_schedules:
+            self.checks.schedule(order_id, time.time() + self._next_interval(payment), payment)
+
+    def forget(self, order_id: str):
+        self.expiry.cancel(order_id)
+        self.checks.cancel(order_id)
+        self._last_checked.pop(order_id, None)
+
+    def _next_interval(self, payment) -> float:
+        fast_interval, fresh_for, max_interval = self.poll_schedules[payment['payment_system']]
+        age = time.time() - _created_timestamp(payment)
+        if age < fresh_for:
+            return fast_interval
+        # Doubles with every further fresh_for seconds of age, up to the cap.
+        return min(max_interval, fast_interval * 2 ** ((age - fresh_for) / fresh_for))
+
+    async def _poll(self, order_id: str, payment):
+        if order_id not in self.expiry:
+            return
+        await self._check(payment)
+        if order_id in self.expiry and order_id not in self.checks:
+            self.checks.schedule(order_id, time.time() + self._next_interval(payment), payment)
+
+    async def check_now(self, order_id: str, user_id: int) -> Optional[bool]:
+        # None when the invoice is no longer pending, otherwise whether it has just been credited.
+        payment = self.expiry.payload(order_id)
+        if payment is None or payment['user_id'] != user_id:
+            return None
+        if payment['payment_system'] not in self.poll_schedules:
+            return False
+        if time.monotonic() - self._last_checked.get(order_id, float('-inf')) < MANUAL_CHECK_COOLDOWN:
+            return False
+        metrics.inc("payment_monitor.manual_checks")
+        return await self._check(payment)
+
+    async def _check(self, payment) -> bool:
+        order_id = payment['uuid']
+        payment_system = payment['payment_system']
+        self._last_checked[order_id] = time.monotonic()
+        started = time.monotonic()
+        try:
+            if payment_system == 'lzt':
+                await self._refresh_lzt()
+                is_paid, _ = self.lzt_index.find(order_id)
+            else:
+                invoice_id = payment['external_invoice_id']
+                if not invoice_id:
+                    return False
+                async with self._limits[payment_system]:
+                    is_paid, _ = await check_crystalpay_invoice(self.config, invoice_id, self.client)
+        except Exception as e:
+            metrics.inc(f"payment_monitor.{payment_system}.errors")
+            logging.warning(f"Monitor: Failed to check {payment_system} payment {order_id}: {e}")
+            return False
+        finally:
+            metrics.inc("payment_monitor.checked")
+            metrics.observe(f"payment_monitor.{payment_system}.check_seconds", time.monotonic() - started)
+
+        if is_paid:
+            return await self.credit(order_id, payment_system)
+        return False
+
+    async def _refresh_lzt(self):
+        # LZT invoices due together share one fetch, and fetches happen at most once per fast interval.
+        if self._lzt_refresh is None:
+            if time.monotonic() - self._lzt_refreshed_at < POLL_SCHEDULES['lzt'][0]:
+                return
+            self._lzt_refresh = asyncio.create_task(self._run_lzt_refresh())
+        await asyncio.shield(self._lzt_refresh)
+
+    async def _run_lzt_refresh(self):
+        try:
+            await self.lzt_index.refresh(self.client)
+            self._lzt_refreshed_at = time.monotonic()
+        finally:
+            self._lzt_refresh = None
+
+    async def credit(self, order_id: str, payment_system: str) -> bool:
+        payment_info = await self.repo.process_successful_payment(order_id)
+        if not payment_info:
+            return False
+        self.forget(order_id)
+
+        logging.info(f"Successfully processed {payment_system} payment for order_id {order_id}.")
+        metrics.inc(f"payment_monitor.{payment_system}.credited")
+        metrics.observe(f"payment_monitor.{payment_system}.time_to_credit_seconds", time.time() - _created_timestamp(payment_info))
+        try:
+            user = await self.repo.get_user(payment_info['user_id'])
+            await self.bot.edit_message_text(
+                chat_id=payment_info["user_id"],
+                message_id=payment_info["message_id"],
+                text=f"✅ Платеж успешно выполнен!\n\n💰 Сумма: {payment_info['amount']:.2f}₽\n💳 Ваш новый баланс: {user['balance']:.2f}₽",
+                reply_markup=None
+            )
+        except Exception as e:
+            logging.error(f"Monitor: Failed to edit notification for user {payment_info['user_id']}: {e}")
+        return True
+
+    async def _expire(self, order_id: str, payment):
+        user_id = payment['user_id']
+        self.checks.cancel(order_id)
+        self._last_checked.pop(order_id, None)
+        try:
+            status_was_updated = await self.repo.update_payment_status(order_id, 'expired')
+        except Exception:
+            # Try again shortly rather than leaving the payment pending forever.
+            self.expiry.schedule(order_id, time.time() + 30, payment)
+            raise
+        if status_was_updated:
+            logging.info(f"Payment {order_id} for user {user_id} has expired. Status updated.")
+            try:
+                await self.bot.edit_message_text(
+                    chat_id=user_id,
+                    message_id=payment['message_id'],
+                    text="❌ Время оплаты истекло. Счет был отменен.",
+                    reply_markup=None
+                )
+            except Exception:
+                pass
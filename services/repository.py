@@ -1,225 +1,403 @@
 import aiosqlite
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional, Tuple
+from typing import Callable, List, Dict, Any, Optional, Set, Tuple
+
+from database import Database
+from services.cache import TTLCache
+from services.metrics import metrics
+
+# User rows already loaded while handling the current update.
+_identity_map: ContextVar[Optional[Dict[int, aiosqlite.Row]]] = ContextVar("identity_map", default=None)
 
 class Repository:
-    def __init__(self, db: aiosqlite.Connection):
+    def __init__(self, db: Database, user_cache_size: int = 10000, user_cache_ttl: float = 300):
         self.db = db
+        self._settings: Dict[str, str] = {}
+        self._settings_version: Optional[int] = None
+        self._users = TTLCache("users", user_cache_size, user_cache_ttl, negative_ttl=0)
+        self._user_invalidations = 0
+        self._blocked_users: Set[int] = set()
+        self._payment_listeners: List[Callable[[aiosqlite.Row], None]] = []
+
+    @contextmanager
+    def user_scope(self):
+        token = _identity_map.set({})
+        try:
+            yield
+        finally:
+            _identity_map.reset(token)
+
+    def _remember_user(self, user: aiosqlite.Row):
+        identity_map = _identity_map.get()
+        if identity_map is not None:
+            identity_map[user['telegram_id']] = user
+        self._users.set(user['telegram_id'], user)
+
+    def _forget_user(self, user_id: int):
+        # Called after the write has committed, so the next read sees the new row.
+        self._user_invalidations += 1
+        identity_map = _identity_map.get()
+        if identity_map is not None:
+            identity_map.pop(user_id, None)
+        self._users.invalidate(user_id)
 
     async def get_or_create_user(self, telegram_id: int, username: str) -> aiosqlite.Row:
-        cursor = await self.db.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,))
-        user = await cursor.fetchone()
-        if not user:
-            await self.db.execute(
-                "INSERT INTO users (telegram_id, username) VALUES (?, ?)",
+        user = await self.get_user(telegram_id)
+        if user and (not username or user['username'] == username):
+            return user
+        async with self.db.write() as conn:
+            cursor = await conn.execute(
+                """INSERT INTO users (telegram_id, username) VALUES (?, ?)
+                   ON CONFLICT (telegram_id) DO UPDATE SET username = COALESCE(excluded.username, users.username)
+                   RETURNING *""",
                 (telegram_id, username)
             )
-            await self.db.commit()
-            cursor = await self.db.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,))
             user = await cursor.fetchone()
+        self._forget_user(telegram_id)
+        self._remember_user(user)
         return user
 
     async def get_user_by_id_or_username(self, user_input: str) -> Optional[aiosqlite.Row]:
         params = (user_input,)
         query = "SELECT * FROM users WHERE telegram_id = ?" if user_input.isdigit() else "SELECT * FROM users WHERE username = ?"
-        cursor = await self.db.execute(query, params)
-        return await cursor.fetchone()
-    
+        async with self.db.read() as conn:
+            cursor = await conn.execute(query, params)
+            return await cursor.fetchone()
+
     async def get_user(self, user_id: int) -> Optional[aiosqlite.Row]:
-        cursor = await self.db.execute("SELECT * FROM users WHERE telegram_id = ?", (user_id,))
-        return await cursor.fetchone()
+        identity_map = _identity_map.get()
+        if identity_map is not None and user_id in identity_map:
+            return identity_map[user_id]
+
+        user = self._users.get(user_id, None)
+        if user is not None:
+            metrics.inc("cache.users.hit")
+        else:
+            metrics.inc("cache.users.miss")
+            invalidations = self._user_invalidations
+            async with self.db.read() as conn:
+                cursor = await conn.execute("SELECT * FROM users WHERE telegram_id = ?", (user_id,))
+                user = await cursor.fetchone()
+            if user is None:
+                return None
+            # A write that committed during the read may have made this row stale.
+            if invalidations != self._user_invalidations:
+                return user
+        self._remember_user(user)
+        return user
 
     async def update_user_block_status(self, user_id: int, is_blocked: bool) -> None:
-        await self.db.execute("UPDATE users SET is_blocked = ? WHERE telegram_id = ?", (int(is_blocked), user_id))
-        await self.db.commit()
+        async with self.db.write() as conn:
+            await conn.execute("UPDATE users SET is_blocked = ? WHERE telegram_id = ?", (int(is_blocked), user_id))
+        self._forget_user(user_id)
+        if is_blocked:
+            self._blocked_users.add(user_id)
+        else:
+            self._blocked_users.discard(user_id)
 
     async def update_user_balance(self, user_id: int, amount: float, operation: str = 'add') -> None:
         op_char = '+' if operation == 'add' else '-'
-        await self.db.execute(f"UPDATE users SET balance = balance {op_char} ? WHERE telegram_id = ?", (amount, user_id))
-        await self.db.commit()
+        async with self.db.write() as conn:
+            await conn.execute(f"UPDATE users SET balance = balance {op_char} ? WHERE telegram_id = ?", (amount, user_id))
+        self._forget_user(user_id)
+
+    async def hold(self, user_id: int, amount: float) -> Optional[int]:
+        async with self.db.write() as conn:
+            cursor = await conn.execute(
+                "UPDATE users SET balance = balance - ? WHERE telegram_id = ? AND balance >= ?",
+                (amount, user_id, amount)
+            )
+            if cursor.rowcount == 0:
+                return None
+            cursor = await conn.execute("INSERT INTO balance_holds (user_id, amount) VALUES (?, ?)", (user_id, amount))
+            hold_id = cursor.lastrowid
+        self._forget_user(user_id)
+        return hold_id
+
+    async def capture(self, hold_id: int, p_type: str, desc: str, amount: int, profit: float = 0) -> bool:
+        async with self.db.write() as conn:
+            cursor = await conn.execute(
+                "UPDATE balance_holds SET status = 'captured', settled_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'held' RETURNING user_id, amount",
+                (hold_id,)
+            )
+            held = await cursor.fetchone()
+            if not held:
+                return False
+            await conn.execute("UPDATE users SET discount = NULL WHERE telegram_id = ?", (held['user_id'],))
+            await conn.execute(
+                "INSERT INTO purchase_history (user_id, purchase_type, item_description, amount, cost, profit) VALUES (?, ?, ?, ?, ?, ?)",
+                (held['user_id'], p_type, desc, amount, held['amount'], profit)
+            )
+        self._forget_user(held['user_id'])
+        return True
+
+    async def release(self, hold_id: int) -> bool:
+        async with self.db.write() as conn:
+            cursor = await conn.execute(
+                "UPDATE balance_holds SET status = 'released', settled_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'held' RETURNING user_id, amount",
+                (hold_id,)
+            )
+            held = await cursor.fetchone()
+            if not held:
+                return False
+            await conn.execute("UPDATE users SET balance = balance + ? WHERE telegram_id = ?", (held['amount'], held['user_id']))
+        self._forget_user(held['user_id'])
+        return True
+
+    async def get_open_holds(self) -> List[aiosqlite.Row]:
+        async with self.db.read() as conn:
+            cursor = await conn.execute("SELECT * FROM balance_holds WHERE status = 'held' ORDER BY id")
+            return await cursor.fetchall()
 
     async def update_user_discount(self, user_id: int, discount: Optional[float]) -> None:
-        await self.db.execute("UPDATE users SET discount = ? WHERE telegram_id = ?", (discount, user_id))
-        await self.db.commit()
-        
+        async with self.db.write() as conn:
+            await conn.execute("UPDATE users SET discount = ? WHERE telegram_id = ?", (discount, user_id))
+        self._forget_user(user_id)
+
     async def get_all_users_for_broadcast(self) -> List[aiosqlite.Row]:
-        cursor = await self.db.execute("SELECT telegram_id FROM users WHERE is_blocked = 0")
-        return await cursor.fetchall()
-        
-    async def is_user_blocked(self, user_id: int) -> bool:
-        cursor = await self.db.execute("SELECT is_blocked FROM users WHERE telegram_id = ?", (user_id,))
-        row = await cursor.fetchone()
-        return row and row['is_blocked'] == 1
+        async with self.db.read() as conn:
+            cursor = await conn.execute("SELECT telegram_id FROM users WHERE is_blocked = 0")
+            return await cursor.fetchall()
+
+    async def load_blocked_users(self) -> None:
+        async with self.db.read() as conn:
+            cursor = await conn.execute("SELECT telegram_id FROM users WHERE is_blocked = 1")
+            self._blocked_users = {row['telegram_id'] for row in await cursor.fetchall()}
+        metrics.set("users.blocked", len(self._blocked_users))
+
+    def is_user_blocked(self, user_id: int) -> bool:
+        return user_id in self._blocked_users
 
     async def get_total_stars_bought(self, user_id: int) -> int:
-        cursor = await self.db.execute(
-            "SELECT COALESCE(SUM(amount), 0) FROM purchase_history WHERE user_id = ? AND purchase_type = 'stars'",
-            (user_id,)
-        )
-        return (await cursor.fetchone())[0]
+        async with self.db.read() as conn:
+            cursor = await conn.execute(
+                "SELECT COALESCE(SUM(amount), 0) FROM purchase_history WHERE user_id = ? AND purchase_type = 'stars'",
+                (user_id,)
+            )
+            return (await cursor.fetchone())[0]
 
     async def get_total_top_up(self, user_id: int) -> float:
-        cursor = await self.db.execute("SELECT COALESCE(SUM(amount), 0) FROM payments WHERE user_id = ? AND status = 'paid'", (user_id,))
-        return (await cursor.fetchone())[0]
-
-    async def mark_old_payments_as_expired(self, user_id: int) -> None:
-        fifteen_minutes_ago = (datetime.utcnow() - timedelta(minutes=15)).isoformat()
-        await self.db.execute(
-            "UPDATE payments SET status = 'expired' WHERE user_id = ? AND status = 'pending' AND created_at <= ?",
-            (user_id, fifteen_minutes_ago)
-        )
-        await self.db.commit()
+        async with self.db.read() as conn:
+            cursor = await conn.execute("SELECT COALESCE(SUM(amount), 0) FROM payments WHERE user_id = ? AND status = 'paid'", (user_id,))
+            return (await cursor.fetchone())[0]
 
     async def get_active_payment(self, user_id: int) -> Optional[aiosqlite.Row]:
-        cursor = await self.db.execute(
-            "SELECT * FROM payments WHERE user_id = ? AND status = 'pending'",
-            (user_id,)
-        )
-        return await cursor.fetchone()
+        async with self.db.read() as conn:
+            cursor = await conn.execute(
+                "SELECT * FROM payments WHERE user_id = ? AND status = 'pending'",
+                (user_id,)
+            )
+            return await cursor.fetchone()
+
+    async def get_payment(self, order_id: str) -> Optional[aiosqlite.Row]:
+        async with self.db.read() as conn:
+            cursor = await conn.execute("SELECT * FROM payments WHERE uuid = ?", (order_id,))
+            return await cursor.fetchone()
+
+    def add_payment_listener(self, listener: Callable[[aiosqlite.Row], None]) -> None:
+        self._payment_listeners.append(listener)
 
     async def create_payment(self, order_id: str, user_id: int, message_id: int, amount_rub: float, payment_system: str, invoice_url: Optional[str] = None, external_invoice_id: Optional[str] = None) -> None:
-        await self.db.execute(
-            "INSERT INTO payments (uuid, user_id, message_id, amount, payment_system, invoice_url, external_invoice_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (order_id, user_id, message_id, amount_rub, payment_system, invoice_url, external_invoice_id)
-        )
-        await self.db.commit()
+        async with self.db.write() as conn:
+            cursor = await conn.execute(
+                "INSERT INTO payments (uuid, user_id, message_id, amount, payment_system, invoice_url, external_invoice_id) VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING *",
+                (order_id, user_id, message_id, amount_rub, payment_system, invoice_url, external_invoice_id)
+            )
+            payment = await cursor.fetchone()
+        self._forget_user(user_id)
+        for listener in self._payment_listeners:
+            listener(payment)
 
     async def update_payment_status(self, order_id: str, new_status: str) -> bool:
-        cursor = await self.db.execute(
-            "UPDATE payments SET status = ? WHERE uuid = ? AND status = 'pending'",
-            (new_status, order_id)
-        )
-        await self.db.commit()
+        async with self.db.write() as conn:
+            cursor = await conn.execute(
+                "UPDATE payments SET status = ? WHERE uuid = ? AND status = 'pending'",
+                (new_status, order_id)
+            )
         return cursor.rowcount > 0
-        
-    async def get_user_payments_page(self, user_id: int, page: int, page_size: int) -> List[aiosqlite.Row]:
-        offset = (page - 1) * page_size
-        cursor = await self.db.execute(
-            "SELECT uuid, amount, created_at, status, payment_system FROM payments WHERE user_id = ? ORDER BY created_at DESC LIMIT ? OFFSET ?",
-            (user_id, page_size, offset)
-        )
-        return await cursor.fetchall()
-        
+
+    async def get_user_payments_page(self, user_id: int, page_size: int, after: Optional[List] = None) -> List[aiosqlite.Row]:
+        # after is the (created_at, uuid) of the last row on the previous page.
+        query = "SELECT uuid, amount, created_at, status, payment_system FROM payments WHERE user_id = ?"
+        params: List[Any] = [user_id]
+        if after:
+            query += " AND created_at <= ? AND (created_at, uuid) < (?, ?)"
+            params += [after[0], after[0], after[1]]
+        query += " ORDER BY created_at DESC, uuid DESC LIMIT ?"
+        async with self.db.read() as conn:
+            cursor = await conn.execute(query, (*params, page_size))
+            return await cursor.fetchall()
+
     async def count_user_payments(self, user_id: int) -> int:
-        cursor = await self.db.execute("SELECT COUNT(*) FROM payments WHERE user_id = ?", (user_id,))
-        return (await cursor.fetchone())[0]
-        
+        user = await self.get_user(user_id)
+        return user['payments_count'] if user else 0
+
+    async def get_user_history_page(self, user_id: int, page_size: int, after: Optional[List] = None) -> List[aiosqlite.Row]:
+        # Payments and purchases merged newest first; after is the (created_at, kind, ref) of the previous page's last row.
+        branches = [
+            ("payment", "SELECT 'payment' AS kind, uuid AS ref, amount, payment_system AS details, status, created_at "
+                        "FROM payments WHERE user_id = ?", "uuid"),
+            ("purchase", "SELECT 'purchase' AS kind, id AS ref, cost AS amount, item_description AS details, NULL AS status, created_at "
+                         "FROM purchase_history WHERE user_id = ?", "id"),
+        ]
+        parts, params = [], []
+        for kind, query, key in branches:
+            params.append(user_id)
+            if after:
+                query += f" AND created_at <= ? AND (created_at, '{kind}', {key}) < (?, ?, ?)"
+                params += [after[0], *after]
+            parts.append(f"SELECT * FROM ({query} ORDER BY created_at DESC, {key} DESC LIMIT ?)")
+            params.append(page_size)
+        query = " UNION ALL ".join(parts) + " ORDER BY created_at DESC, kind DESC, ref DESC LIMIT ?"
+        async with self.db.read() as conn:
+            cursor = await conn.execute(query, (*params, page_size))
+            return await cursor.fetchall()
+
+    async def count_user_history(self, user_id: int) -> int:
+        user = await self.get_user(user_id)
+        return user['payments_count'] + user['purchases_count'] if user else 0
+
     async def get_all_pending_payments(self) -> List[aiosqlite.Row]:
-        cursor = await self.db.execute("SELECT * FROM payments WHERE status = 'pending'")
-        return await cursor.fetchall()
+        async with self.db.read() as conn:
+            cursor = await conn.execute("SELECT * FROM payments WHERE status = 'pending'")
+            return await cursor.fetchall()
 
     async def process_successful_payment(self, order_id: str) -> Optional[Dict[str, Any]]:
-        async with self.db.execute("BEGIN") as cursor:
-            await cursor.execute("SELECT * FROM payments WHERE uuid = ?", (order_id,))
+        # The single writer serializes this check-and-update against every other write.
+        async with self.db.write() as conn:
+            cursor = await conn.execute("SELECT * FROM payments WHERE uuid = ?", (order_id,))
             payment = await cursor.fetchone()
 
             if not payment or payment["status"] != 'pending':
                 return None
-            
-            await cursor.execute("UPDATE payments SET status = 'paid' WHERE uuid = ?", (order_id,))
+
+            await conn.execute("UPDATE payments SET status = 'paid' WHERE uuid = ?", (order_id,))
             amount = float(payment["amount"])
-            await cursor.execute("UPDATE users SET balance = balance + ? WHERE telegram_id = ?", (amount, payment["user_id"]))
-        await self.db.commit()
+            await conn.execute("UPDATE users SET balance = balance + ? WHERE telegram_id = ?", (amount, payment["user_id"]))
+        self._forget_user(payment["user_id"])
         return dict(payment)
 
-    async def add_purchase_to_history(self, user_id: int, p_type: str, desc: str, amount: int, cost: float, profit: float = 0) -> None:
-        await self.db.execute(
-            "INSERT INTO purchase_history (user_id, purchase_type, item_description, amount, cost, profit) VALUES (?, ?, ?, ?, ?, ?)",
-            (user_id, p_type, desc, amount, cost, profit)
-        )
-        await self.db.commit()
-
     async def get_promo_by_code(self, code: str) -> Optional[aiosqlite.Row]:
-        cursor = await self.db.execute("SELECT * FROM promo_codes WHERE code = ? AND is_active = 1", (code,))
-        return await cursor.fetchone()
+        async with self.db.read() as conn:
+            cursor = await conn.execute("SELECT * FROM promo_codes WHERE code = ? AND is_active = 1", (code,))
+            return await cursor.fetchone()
 
     async def check_promo_usage_by_user(self, user_id: int, promo_id: int) -> bool:
-        cursor = await self.db.execute("SELECT 1 FROM promo_history WHERE user_id = ? AND promo_code_id = ?", (user_id, promo_id))
-        return await cursor.fetchone() is not None
+        async with self.db.read() as conn:
+            cursor = await conn.execute("SELECT 1 FROM promo_history WHERE user_id = ? AND promo_code_id = ?", (user_id, promo_id))
+            return await cursor.fetchone() is not None
 
     async def activate_promo_for_user(self, user_id: int, promo: aiosqlite.Row) -> None:
-        await self.db.execute("UPDATE promo_codes SET current_uses = current_uses + 1 WHERE id = ?", (promo['id'],))
-        await self.db.execute("INSERT INTO promo_history (user_id, promo_code_id) VALUES (?, ?)", (user_id, promo['id']))
-        if promo['promo_type'] == 'discount':
-            await self.update_user_discount(user_id, promo['value'])
-        else:
-            await self.update_user_balance(user_id, promo['value'], 'add')
-        await self.db.commit()
+        async with self.db.write() as conn:
+            await conn.execute("UPDATE promo_codes SET current_uses = current_uses + 1 WHERE id = ?", (promo['id'],))
+            await conn.execute("INSERT INTO promo_history (user_id, promo_code_id) VALUES (?, ?)", (user_id, promo['id']))
+            if promo['promo_type'] == 'discount':
+                await self.update_user_discount(user_id, promo['value'])
+            else:
+                await self.update_user_balance(user_id, promo['value'], 'add')
+        self._forget_user(user_id)
 
     async def create_promo_code(self, code: str, p_type: str, value: float, max_uses: int = None, expires_at: str = None) -> None:
-        await self.db.execute(
-            "INSERT INTO promo_codes (code, promo_type, value, max_uses, expires_at, is_active) VALUES (?, ?, ?, ?, ?, 1)",
-            (code, p_type, value, max_uses, expires_at)
-        )
-        await self.db.commit()
+        async with self.db.write() as conn:
+            await conn.execute(
+                "INSERT INTO promo_codes (code, promo_type, value, max_uses, expires_at, is_active) VALUES (?, ?, ?, ?, ?, 1)",
+                (code, p_type, value, max_uses, expires_at)
+            )
 
     async def get_active_promo_codes(self) -> List[aiosqlite.Row]:
-        cursor = await self.db.execute("SELECT code FROM promo_codes WHERE is_active = 1")
-        return await cursor.fetchall()
-        
+        async with self.db.read() as conn:
+            cursor = await conn.execute("SELECT code FROM promo_codes WHERE is_active = 1")
+            return await cursor.fetchall()
+
     async def get_all_promo_codes(self) -> List[aiosqlite.Row]:
-        cursor = await self.db.execute("SELECT code FROM promo_codes")
-        return await cursor.fetchall()
-        
+        async with self.db.read() as conn:
+            cursor = await conn.execute("SELECT code FROM promo_codes")
+            return await cursor.fetchall()
+
     async def delete_promo_code(self, code: str) -> None:
-        await self.db.execute("DELETE FROM promo_codes WHERE code = ?", (code,))
-        await self.db.commit()
-        
+        async with self.db.write() as conn:
+            await conn.execute("DELETE FROM promo_codes WHERE code = ?", (code,))
+
     async def delete_expired_promos(self) -> None:
         now_utc_iso = datetime.utcnow().isoformat()
-        await self.db.execute("DELETE FROM promo_codes WHERE expires_at IS NOT NULL AND expires_at < ?", (now_utc_iso,))
-        await self.db.commit()
-    
-    async def get_setting(self, key: str) -> Optional[str]:
-        cursor = await self.db.execute("SELECT value FROM settings WHERE key = ?", (key,))
-        row = await cursor.fetchone()
-        return row['value'] if row else None
-
-    async def get_multiple_settings(self, keys: List[str]) -> Dict[str, str]:
-        placeholders = ','.join('?' for _ in keys)
-        cursor = await self.db.execute(f"SELECT key, value FROM settings WHERE key IN ({placeholders})", keys)
-        rows = await cursor.fetchall()
-        return {r['key']: r['value'] for r in rows}
+        async with self.db.write() as conn:
+            await conn.execute("DELETE FROM promo_codes WHERE expires_at IS NOT NULL AND expires_at < ?", (now_utc_iso,))
+
+    async def load_settings(self) -> None:
+        # Taken before the read so that a commit racing with it still triggers the next reload.
+        self._settings_version = await self.db.data_version()
+        async with self.db.read() as conn:
+            cursor = await conn.execute("SELECT key, value FROM settings")
+            rows = await cursor.fetchall()
+        self._settings = {r['key']: r['value'] for r in rows}
+        metrics.inc("settings.reloads")
+
+    async def reload_if_changed(self) -> None:
+        # Picks up settings and blocks changed by other processes sharing the database file.
+        if await self.db.data_version() != self._settings_version:
+            await self.load_settings()
+            await self.load_blocked_users()
+
+    def get_setting(self, key: str) -> Optional[str]:
+        return self._settings.get(key)
+
+    def get_multiple_settings(self, keys: List[str]) -> Dict[str, str]:
+        return {key: self._settings[key] for key in keys if key in self._settings}
 
     async def update_setting(self, key: str, value: Any) -> None:
-        await self.db.execute("UPDATE settings SET value = ? WHERE key = ?", (str(value), key))
-        await self.db.commit()
+        async with self.db.write() as conn:
+            cursor = await conn.execute("UPDATE settings SET value = ? WHERE key = ?", (str(value), key))
+            updated = cursor.rowcount > 0
+        if updated:
+            self._settings[key] = str(value)
+
+    def _stats_periods(self) -> Tuple[str, str]:
+        today = datetime.utcnow().date()
+        return today.isoformat(), (today - timedelta(days=30)).isoformat()
 
     async def get_bot_statistics(self) -> Dict[str, int]:
-        today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
-        month_ago = (datetime.utcnow() - timedelta(days=30)).isoformat()
-        
-        queries = {
-            "total_users": "SELECT COUNT(id) FROM users",
-            "month_users": f"SELECT COUNT(id) FROM users WHERE created_at >= '{month_ago}'",
-            "day_stars": f"SELECT COALESCE(SUM(amount), 0) FROM purchase_history WHERE purchase_type = 'stars' AND created_at >= '{today_start}'",
-            "month_stars": f"SELECT COALESCE(SUM(amount), 0) FROM purchase_history WHERE purchase_type = 'stars' AND created_at >= '{month_ago}'",
-            "total_stars": "SELECT COALESCE(SUM(amount), 0) FROM purchase_history WHERE purchase_type = 'stars'"
-        }
-        
-        results = {}
-        for key, query in queries.items():
-            cursor = await self.db.execute(query)
-            results[key] = (await cursor.fetchone())[0]
-            
-        return results
+        today, month_start = self._stats_periods()
+        async with self.db.read() as conn:
+            cursor = await conn.execute(
+                """SELECT COALESCE(SUM(new_users), 0) AS total_users,
+                          COALESCE(SUM(CASE WHEN day >= ? THEN new_users END), 0) AS month_users
+                   FROM daily_users""",
+                (month_start,)
+            )
+            users = await cursor.fetchone()
+            cursor = await conn.execute(
+                """SELECT COALESCE(SUM(CASE WHEN day >= ? THEN quantity END), 0) AS day_stars,
+                          COALESCE(SUM(CASE WHEN day >= ? THEN quantity END), 0) AS month_stars,
+                          COALESCE(SUM(quantity), 0) AS total_stars
+                   FROM daily_stats WHERE product = 'stars'""",
+                (today, month_start)
+            )
+            stars = await cursor.fetchone()
+        return {**dict(users), **dict(stars)}
 
     async def get_profit_statistics(self) -> Dict[str, float]:
-        today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
-        month_ago = (datetime.utcnow() - timedelta(days=30)).isoformat()
-        
-        queries = {
-            "day_profit": f"SELECT COALESCE(SUM(profit), 0) FROM purchase_history WHERE created_at >= '{today_start}'",
-            "month_profit": f"SELECT COALESCE(SUM(profit), 0) FROM purchase_history WHERE created_at >= '{month_ago}'",
-            "total_profit": "SELECT COALESCE(SUM(profit), 0) FROM purchase_history",
-            "day_revenue": f"SELECT COALESCE(SUM(cost), 0) FROM purchase_history WHERE created_at >= '{today_start}'",
-            "month_revenue": f"SELECT COALESCE(SUM(cost), 0) FROM purchase_history WHERE created_at >= '{month_ago}'",
-            "total_revenue": "SELECT COALESCE(SUM(cost), 0) FROM purchase_history"
-        }
-        
-        results = {}
-        for key, query in queries.items():
-            cursor = await self.db.execute(query)
-            results[key] = float((await cursor.fetchone())[0])
-            
+        today, month_start = self._stats_periods()
+        async with self.db.read() as conn:
+            cursor = await conn.execute(
+                """SELECT COALESCE(SUM(CASE WHEN day >= ? THEN profit END), 0) AS day_profit,
+                          COALESCE(SUM(CASE WHEN day >= ? THEN profit END), 0) AS month_profit,
+                          COALESCE(SUM(profit), 0) AS total_profit,
+                          COALESCE(SUM(CASE WHEN day >= ? THEN revenue END), 0) AS day_revenue,
+                          COALESCE(SUM(CASE WHEN day >= ? THEN revenue END), 0) AS month_revenue,
+                          COALESCE(SUM(revenue), 0) AS total_revenue,
+                          COALESCE(SUM(CASE WHEN day >= ? THEN orders END), 0) AS day_orders,
+                          COALESCE(SUM(CASE WHEN day >= ? THEN orders END), 0) AS month_orders,
+                          COALESCE(SUM(orders), 0) AS total_orders
+                   FROM daily_stats""",
+                (today, month_start, today, month_start, today, month_start)
+            )
+            totals = dict(await cursor.fetchone())
+            cursor = await conn.execute("SELECT COALESCE(SUM(new_users), 0) FROM daily_users")
+            total_users = (await cursor.fetchone())[0]
+
+        results = {key: float(value) for key, value in totals.items() if not key.endswith("_orders")}
+        results.update({key: int(value) for key, value in totals.items() if key.endswith("_orders")})
+        results["total_users"] = total_users
         return results
\ No newline at end of file
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Optional
+
+from .metrics import metrics
+
+class AdaptiveLimiter:
+    # AIMD: the limit grows by 1/limit per fast success and halves on an error or a slow call.
+    def __init__(self, name: str, min_limit: int, max_limit: int, target_latency: float):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @asynccontextmanager
+    async def acquire(self):
+        await self._acquire()
+        started = time.monotonic()
+        try:
+            yield
+        except asyncio.CancelledError:
+            self._release()
+            raise
+        except Exception:
+            self._release(time.monotonic() - started, failed=True)
+            raise
+        else:
+            self._release(time.monotonic() - started, failed=False)
+
+    async def _acquire(self):
+        started = time.monotonic()
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                else:
+                    self._wake()
+                raise
+        self.in_flight += 1
+        metrics.observe(f"{self.name}.wait_seconds", time.monotonic() - started)
+        metrics.set(f"{self.name}.in_flight", self.in_flight)
+
+    def _release(self, latency: Optional[float] = None, failed: bool = False):
+        self.in_flight -= 1
+        if latency is not None:
+            if failed or latency > self.target_latency:
+                self.limit = max(float(self.min_limit), self.limit / 2)
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+        metrics.set(f"{self.name}.limit", self.limit)
+        metrics.set(f"{self.name}.in_flight", self.in_flight)
+        self._wake()
+
+    def _wake(self):
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float,
+                 on_state_change: Optional[Callable[[str, str], None]] = None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_state_change = on_state_change
+        self.failures = 0
+        self.opened_at = 0.0
+        self._state = self.CLOSED
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._set_state(self.HALF_OPEN)
+        return self._state
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probe_in_flight:
+            # Let a single request through to find out whether the service is back.
+            self._probe_in_flight = True
+            return True
+        metrics.inc(f"{self.name}.rejected")
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self._probe_in_flight = False
+        if self._state != self.CLOSED:
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self._state == self.HALF_OPEN or (self._state == self.CLOSED and self.failures >= self.failure_threshold):
+            self.opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+    def record_cancelled(self):
+        self._probe_in_flight = False
+
+    def _set_state(self, state: str):
+        old_state, self._state = self._state, state
+        logging.warning(f"Circuit breaker {self.name}: {old_state} -> {state}")
+        metrics.inc(f"{self.name}.{state}")
+        if self.on_state_change is not None:
+            self.on_state_change(old_state, state)
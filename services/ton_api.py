@@ -11,7 +11,7 @@ async def get_ton_balance(wallet_address: str) -> tuple[float, str | None]:
 
     try:
         async with httpx.AsyncClient() as client:
-            response = await client.get(f"https://toncenter.com/api/v2/getAddressBalance?address=UQD4Vn7gzYxqXYoOl4Vw0WdIzbvOYrTVZER20rbXadlu6sSb")
+            response = await client.get(f"https://toncenter.com/api/v2/getAddressBalance?address={address_str}")
             if response.status_code == 200:
                 data = response.json()
                 if data.get('ok'):
@@ -0,0 +1,192 @@
+import asyncio
+import base64
+import logging
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from tonutils.client import TonapiClient
+from tonutils.wallet import WalletV4R2
+from tonutils.wallet.messages import TransferMessage
+
+from config import Config
+from .metrics import metrics
+
+# Covers the forward and compute fees of one internal message.
+FEE_RESERVE_NANO = 10_000_000
+
+
+@dataclass
+class Reservation:
+    wallet: "HotWallet"
+    amount_nano: int
+    settled: bool = False
+
+
+class HotWallet:
+    def __init__(self, index: int, config: Config, ton_client: TonapiClient, wallet: WalletV4R2, public_key: bytes):
+        self.index = index
+        self.config = config
+        self.ton_client = ton_client
+        self.wallet = wallet
+        self.address = wallet.address
+        self.raw_address = wallet.address.to_str(is_user_friendly=False)
+        self.public_key = public_key.hex()
+        self.state_init = base64.b64encode(wallet.state_init.serialize().to_boc()).decode()
+        self.in_flight = 0
+        self.balance_nano: int | None = None
+        self.reserved_nano = 0
+        self._batch: List[Tuple[TransferMessage, Reservation, asyncio.Future]] = []
+        self._batch_full = asyncio.Event()
+        self._batch_task: asyncio.Task | None = None
+        self._next_seqno: int | None = None
+
+    @property
+    def name(self) -> str:
+        return f"wallet_{self.index}"
+
+    @property
+    def available_nano(self) -> int | None:
+        if self.balance_nano is None:
+            return None
+        return self.balance_nano - self.reserved_nano
+
+    @property
+    def busy(self) -> bool:
+        return self._batch_task is not None
+
+    def reserve(self, amount_nano: int) -> Optional[Reservation]:
+        amount_nano += FEE_RESERVE_NANO
+        if self.available_nano is not None and self.available_nano < amount_nano:
+            return None
+        self.reserved_nano += amount_nano
+        self.in_flight += 1
+        self._report_ledger()
+        return Reservation(self, amount_nano)
+
+    def resize(self, reservation: Reservation, amount_nano: int) -> bool:
+        amount_nano += FEE_RESERVE_NANO
+        delta = amount_nano - reservation.amount_nano
+        if delta > 0 and self.available_nano is not None and self.available_nano < delta:
+            return False
+        self.reserved_nano += delta
+        reservation.amount_nano = amount_nano
+        self._report_ledger()
+        return True
+
+    def commit(self, reservation: Reservation):
+        if reservation.settled:
+            return
+        reservation.settled = True
+        self.reserved_nano -= reservation.amount_nano
+        if self.balance_nano is not None:
+            self.balance_nano -= reservation.amount_nano
+        self.in_flight -= 1
+        self._report_ledger()
+
+    def release(self, reservation: Reservation):
+        if reservation.settled:
+            return
+        reservation.settled = True
+        self.reserved_nano -= reservation.amount_nano
+        self.in_flight -= 1
+        self._report_ledger()
+
+    def sync(self, balance_nano: int):
+        # Transfers still waiting for their seqno are not visible on chain yet, so only resync idle wallets.
+        if self.busy and self.balance_nano is not None:
+            return
+        self.balance_nano = balance_nano
+        self._report_ledger()
+
+    def _report_ledger(self):
+        metrics.set(f"ton.{self.name}.in_flight", self.in_flight)
+        metrics.set(f"ton.{self.name}.reserved", self.reserved_nano / 1_000_000_000)
+        if self.balance_nano is not None:
+            metrics.set(f"ton.{self.name}.balance", self.balance_nano / 1_000_000_000)
+
+    async def submit(self, message: TransferMessage, reservation: Reservation) -> str:
+        # The batch settles the reservation: committed once broadcast, released if it never goes out.
+        entry = (message, reservation, asyncio.get_running_loop().create_future())
+        self._batch.append(entry)
+
+        if len(self._batch) >= self._batch_limit():
+            self._batch_full.set()
+        if self._batch_task is None:
+            self._batch_task = asyncio.create_task(self._run_batches())
+
+        try:
+            return await entry[2]
+        except asyncio.CancelledError:
+            # Still queued, so it will never be sent.
+            if entry in self._batch:
+                self._batch.remove(entry)
+                self.release(reservation)
+            raise
+
+    async def close(self):
+        if self._batch_task is not None:
+            self._batch_full.set()
+            await asyncio.gather(self._batch_task, return_exceptions=True)
+
+    def _batch_limit(self) -> int:
+        # A v4 wallet carries at most four internal messages per external message.
+        return max(1, min(self.config.ton_batch_max_messages, 4))
+
+    async def _run_batches(self):
+        try:
+            while self._batch:
+                if len(self._batch) < self._batch_limit():
+                    self._batch_full.clear()
+                    try:
+                        await asyncio.wait_for(self._batch_full.wait(), self.config.ton_batch_window)
+                    except asyncio.TimeoutError:
+                        pass
+
+                batch = self._batch[:self._batch_limit()]
+                del self._batch[:len(batch)]
+                await self._send_batch(batch)
+        finally:
+            self._batch_task = None
+
+    async def _send_batch(self, batch: List[Tuple[TransferMessage, Reservation, asyncio.Future]]):
+        metrics.observe("ton.batch_size", len(batch))
+        try:
+            if self._next_seqno is None:
+                self._next_seqno = await WalletV4R2.get_seqno(self.ton_client, self.address)
+            seqno = self._next_seqno
+
+            tx_hash = await self.wallet.batch_transfer_messages([message for message, _, _ in batch], seqno=seqno)
+            logging.info(f"[{self.name}] Batch of {len(batch)} transfers sent with seqno {seqno}: {tx_hash}")
+        except Exception as e:
+            self._next_seqno = None
+            metrics.inc(f"ton.{self.name}.batch_failed")
+            for _, reservation, future in batch:
+                self.release(reservation)
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        metrics.inc(f"ton.{self.name}.transfers", len(batch))
+        # Committed whether or not the waiter is still there: the TON has left the wallet.
+        for _, reservation, future in batch:
+            self.commit(reservation)
+            if not future.done():
+                future.set_result(tx_hash)
+
+        self._next_seqno = seqno + 1
+        await self._wait_for_seqno(seqno + 1)
+
+    async def _wait_for_seqno(self, expected: int):
+        # The next external message is only accepted once the wallet has applied this seqno.
+        deadline = time.monotonic() + self.config.ton_confirm_timeout
+        with metrics.timer("ton.batch_confirm_seconds"):
+            while time.monotonic() < deadline:
+                try:
+                    if await WalletV4R2.get_seqno(self.ton_client, self.address) >= expected:
+                        return
+                except Exception as e:
+                    logging.warning(f"[{self.name}] Failed to read wallet seqno: {e}")
+                await asyncio.sleep(1)
+        logging.warning(f"[{self.name}] Seqno {expected} was not confirmed in {self.config.ton_confirm_timeout}s, re-reading from chain")
+        self._next_seqno = None
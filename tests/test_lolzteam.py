@@ -0,0 +1,54 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+
+from payments.lolzteam import LZT_MAX_PAGES, LztPaymentIndex
+
+PAGE_SIZE = 2
+
+
+def make_client(operations):
+    # operations: newest first; serves them a page at a time like /user/payments with operation_id_lt.
+    def handler(request: httpx.Request) -> httpx.Response:
+        before = request.url.params.get('operation_id_lt')
+        page = [op for op in operations if before is None or op['operation_id'] < int(before)][:PAGE_SIZE]
+        return httpx.Response(200, json={'payments': {str(op['operation_id']): op for op in page}})
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def make_operation(operation_id):
+    return {
+        'operation_id': operation_id,
+        'operation_date': time.time(),
+        'operation_type': 'receiving_money',
+        'payment_status': 'success_in',
+        'incoming_sum': 10,
+        'data': {'comment': f'order-{operation_id}'},
+    }
+
+
+def test_refresh_resumes_past_page_cap():
+    async def run():
+        config = SimpleNamespace(lzt_token='token', payment_timeout_seconds=900)
+        index = LztPaymentIndex(config)
+        known = [make_operation(i) for i in range(4, 0, -1)]
+        async with make_client(known) as client:
+            await index.refresh(client)
+        assert index.last_operation_id == 4 and not index.gaps
+
+        # More than one refresh can walk, but little enough for the second one to finish.
+        backlog = PAGE_SIZE * (LZT_MAX_PAGES + 4)
+        newer = [make_operation(i) for i in range(4 + backlog, 4, -1)]
+        async with make_client(newer + known) as client:
+            await index.refresh(client)
+            assert index.last_operation_id == 4 + backlog
+            assert index.gaps
+            assert not index.find('order-5')[0]
+
+            await index.refresh(client)
+            assert not index.gaps
+        assert all(index.find(f'order-{i}')[0] for i in range(1, 5 + backlog))
+
+    asyncio.run(run())
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import asyncio
+import logging
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiosqlite
+
+from config import load_config
+from database import backfill_daily_stats, init_db
+
+HOT_QUERIES = {
+    "get_all_pending_payments": ("SELECT * FROM payments WHERE status = 'pending'", ()),
+    "get_active_payment": ("SELECT * FROM payments WHERE user_id = ? AND status = 'pending'", (1,)),
+    "get_user_payments_page": ("SELECT uuid, amount, created_at, status, payment_system FROM payments WHERE user_id = ? AND created_at <= ? AND (created_at, uuid) < (?, ?) ORDER BY created_at DESC, uuid DESC LIMIT ?", (1, "2024-01-01", "2024-01-01", "", 10)),
+    "get_user_history_purchases": ("SELECT id, cost, created_at FROM purchase_history WHERE user_id = ? AND created_at <= ? AND (created_at, 'purchase', id) < (?, ?, ?) ORDER BY created_at DESC, id DESC LIMIT ?", (1, "2024-01-01", "2024-01-01", "purchase", 0, 10)),
+    "get_total_stars_bought": ("SELECT COALESCE(SUM(amount), 0) FROM purchase_history WHERE user_id = ? AND purchase_type = 'stars'", (1,)),
+    "get_user_by_username": ("SELECT * FROM users WHERE username = ?", ("username",)),
+    "check_promo_usage_by_user": ("SELECT 1 FROM promo_history WHERE user_id = ? AND promo_code_id = ?", (1, 1)),
+}
+
+async def explain_hot_queries():
+    logging.basicConfig(level=logging.INFO)
+
+    config = load_config()
+    await init_db(config.database_path)
+
+    print("🔍 Query plans for hot paths")
+    print("=" * 50)
+
+    full_scans = []
+    async with aiosqlite.connect(config.database_path) as db:
+        cursor = await db.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        print(f"Schema version: {(await cursor.fetchone())[0]}\n")
+
+        for name, (query, params) in HOT_QUERIES.items():
+            cursor = await db.execute(f"EXPLAIN QUERY PLAN {query}", params)
+            plan = [row[3] for row in await cursor.fetchall()]
+            # "SCAN table" without an index means SQLite reads every row.
+            scanned = any(step.startswith("SCAN") and "INDEX" not in step for step in plan)
+            if scanned:
+                full_scans.append(name)
+            print(f"{'❌' if scanned else '✅'} {name}")
+            for step in plan:
+                print(f"   {step}")
+
+    print("\n" + "=" * 50)
+    if full_scans:
+        print(f"❌ Full table scans: {', '.join(full_scans)}")
+        sys.exit(1)
+    print("✅ All hot queries use indexes")
+
+async def rebuild_daily_stats():
+    logging.basicConfig(level=logging.INFO)
+
+    config = load_config()
+    await init_db(config.database_path)
+
+    async with aiosqlite.connect(config.database_path) as db:
+        await backfill_daily_stats(db)
+        await db.commit()
+        cursor = await db.execute("SELECT COUNT(*) FROM daily_stats")
+        print(f"✅ Daily statistics rebuilt: {(await cursor.fetchone())[0]} rows")
+
+if __name__ == "__main__":
+    if "--backfill-stats" in sys.argv:
+        asyncio.run(rebuild_daily_stats())
+    else:
+        asyncio.run(explain_hot_queries())
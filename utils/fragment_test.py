@@ -114,6 +114,7 @@ async def test_fragment_comprehensive():
             print(f"Sending 1 star to @{test_username}...")
             success = await fragment_sender.send_stars(test_username, 1)
             print(f"Result: {'✅ SUCCESS' if success else '❌ FAILED'}")
+            await fragment_sender.close()
     else:
         print("❌ Some tests failed. Please check your configuration.")
     
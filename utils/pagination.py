@@ -0,0 +1,17 @@
+from typing import List, Optional, Tuple
+
+from aiogram.fsm.context import FSMContext
+
+# Keyset cursors do not fit into callback data, so each screen keeps a stack of them in FSM data:
+# cursors[i] is the position of the last row shown on page i + 1.
+
+async def get_page_cursor(state: FSMContext, key: str, page: int) -> Tuple[int, Optional[List]]:
+    cursors = (await state.get_data()).get(key, [])
+    if page <= 1 or len(cursors) < page - 1:
+        return 1, None
+    return page, cursors[page - 2]
+
+async def save_page_cursor(state: FSMContext, key: str, page: int, cursor: List) -> None:
+    cursors = (await state.get_data()).get(key, [])[:page - 1]
+    cursors.append(cursor)
+    await state.update_data({key: cursors})